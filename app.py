@@ -8,7 +8,7 @@ from components.header import render_header
 from components.upload_chat import render_upload_chat
 from components.history import render_history
 from components.notes import render_notes
-from utils.database import ConversationDB
+from utils.database import get_db
 from utils.query_engine import QueryEngine
 from utils.user_manager import UserManager
 from components.local_storage import LocalStorageManager
@@ -150,10 +150,6 @@ if not st.session_state.initialized:
     local_storage = LocalStorageManager()
     stored_data = local_storage.restore_session_data(user_id)
 
-    # Initialize database with user_id
-    db = ConversationDB(user_id=user_id)
-    st.session_state.db = db
-
     # Restore session state
     st.session_state.update(
         {
@@ -215,8 +211,9 @@ if not user_id:
 if "user_id" not in st.session_state:
     st.session_state.user_id = user_id
 
-# Initialize database with user_id
-db = ConversationDB(user_id=user_id)
+# Initialize database with user_id and make it available in the session state
+db = get_db(user_id)
+st.session_state["db"] = db
 
 # Restore session state from local storage
 if "session_restored" not in st.session_state:
@@ -284,11 +281,6 @@ if "show_rename" not in st.session_state:
 if "manually_renamed" not in st.session_state:
     st.session_state["manually_renamed"] = set()
 
-# Add user ID to database operations
-db = ConversationDB(user_id=user_id)
-# ensure the database instance is available in the session state
-st.session_state["db"] = db
-
 # Conversation renaming functionality
 if st.sidebar.button("✏️ Rename Conversation", help="Rename conversation"):
     st.session_state["show_rename"] = True
@@ -359,20 +351,6 @@ if st.sidebar.button("🎬 Start New Conversation"):
     st.session_state["selected_session_id"] = new_session_id
     st.rerun()
 
-# Modify the QueryEngine initialization to use the selected model
-if (
-    st.session_state.get("selected_session_id")
-    and st.session_state["selected_session_id"] not in st.session_state["query_engines"]
-):
-    st.session_state["query_engines"][st.session_state["selected_session_id"]] = (
-        QueryEngine(
-            groq_api_key=os.getenv("GROQ_API_KEY"),
-            session_id=st.session_state["selected_session_id"],
-            model=st.session_state.selected_model,
-            user_id=user_id,  # Add user_id here
-        )
-    )
-
 
 # Add a function to check and update conversation name
 def update_conversation_name_if_needed(session_id):
@@ -404,14 +382,6 @@ with tab3:
     render_notes()
 
 
-# Move db.close() inside a Streamlit event handler to ensure it runs last
-def on_shutdown():
-    if "db" in st.session_state:
-        st.session_state.db.close()
-
-
-st.session_state["_on_shutdown"] = on_shutdown
-
 # Keep the sidebar footer
 st.sidebar.markdown("<br>" * 5, unsafe_allow_html=True)
 st.sidebar.markdown(
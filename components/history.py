@@ -80,15 +80,15 @@ def render_history(db):
                 st.rerun()
         if st.session_state.viewing_conversation == session_id:
             with st.expander("Conversation Details", expanded=True):
-                msgs = db.get_messages(session_id)
-                if not msgs:
+                has_messages = False
+                for role, content, timestamp in db.iter_messages(session_id):
+                    has_messages = True
+                    formatted = datetime.fromisoformat(timestamp).strftime(
+                        "%a, %b %d, %Y at %H:%M"
+                    )
+                    st.chat_message(role).write(content)
+                    st.caption(
+                        f"{'Sent' if role == 'user' else 'Received'} on {formatted}"
+                    )
+                if not has_messages:
                     st.info("No messages in this conversation.")
-                else:
-                    for role, content, timestamp in msgs:
-                        formatted = datetime.fromisoformat(timestamp).strftime(
-                            "%a, %b %d, %Y at %H:%M"
-                        )
-                        st.chat_message(role).write(content)
-                        st.caption(
-                            f"{'Sent' if role == 'user' else 'Received'} on {formatted}"
-                        )
@@ -117,15 +117,14 @@ def render_upload_chat(session_id, db):
                     with confirm_col:
                         if st.button("✓", key=f"confirm_{delete_key}"):
                             try:
-                                if os.path.exists(file_path):
-                                    os.remove(file_path)
                                 if db.delete_file(session_id, file_path):
                                     query_engine = st.session_state[
                                         "query_engines"
                                     ].get(session_id)
                                     if query_engine:
                                         threading.Thread(
-                                            target=query_engine.index_manager.build_index,
+                                            target=query_engine.index_manager.remove_file,
+                                            args=(file_path,),
                                             daemon=True,
                                         ).start()
                                     st.success(f"Deleted {file_name}")
@@ -249,6 +248,10 @@ def render_upload_chat(session_id, db):
                         question, conversation_history=conversation_history
                     )
                     st.write(response)
-                    db.add_message(session_id, "user", question)
-                    db.add_message(session_id, "assistant", response)
+                    saved = db.add_messages(
+                        session_id, [("user", question), ("assistant", response)]
+                    )
+                    if not (saved and db.flush()):
+                        st.error("Failed to save this exchange to the conversation.")
+                        return
                     st.rerun()
@@ -19,12 +19,18 @@ def handle_file_upload(uploaded_file, session_id, db):
         file_path = os.path.join(session_upload_dir, uploaded_file.name)
         if db.add_file(session_id, file_path, uploaded_file.name):
             CHUNK_SIZE = 1024 * 1024  # 1MB
-            with open(file_path, "wb") as f:
+            # Write outside the session directory and rename into place, so
+            # the index never sees a half-written upload
+            partial_path = os.path.join(
+                UPLOAD_DIR, f".{session_id}.{uploaded_file.name}.part"
+            )
+            with open(partial_path, "wb") as f:
                 while True:
                     chunk = uploaded_file.read(CHUNK_SIZE)
                     if not chunk:
                         break
                     f.write(chunk)
+            os.replace(partial_path, file_path)
             return True
         return False
     except Exception:
@@ -67,22 +73,13 @@ def rerun_assistant_message(session_id, assistant_timestamp, user_question, db):
     query_engine = st.session_state["query_engines"].get(session_id)
     if query_engine:
         new_response = query_engine.query(user_question, conversation_history=[])
-        db.add_message(session_id, "assistant", new_response)
+        if not (db.add_message(session_id, "assistant", new_response) and db.flush()):
+            st.error("Failed to save the new response.")
 
 
 def delete_chat_message(session_id, timestamp, db):
     """Delete a single chat message identified by its timestamp."""
-    try:
-        cur = db.conn.cursor()
-        cur.execute(
-            "DELETE FROM messages WHERE session_id = ? AND timestamp = ?",
-            (session_id, timestamp),
-        )
-        db.conn.commit()
-        cur.close()
-        return True
-    except Exception:
-        return False
+    return db.delete_message(session_id, timestamp)
 
 
 def delete_chat_message_pair(session_id, user_timestamp, assistant_timestamp, db):
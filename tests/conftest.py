@@ -0,0 +1,38 @@
+import pytest
+
+from utils import database
+
+
+class FakeLocalStorage:
+    """Stands in for the browser storage, which needs a running Streamlit app."""
+
+    def __init__(self):
+        self.data = {}
+
+    def save_data(self, key, data):
+        self.data[key] = data
+        return True
+
+    def append_data(self, key, items):
+        self.data.setdefault(key, []).extend(items)
+        return True
+
+    def load_data(self, key):
+        return None
+
+
+@pytest.fixture(autouse=True)
+def local_storage(monkeypatch):
+    monkeypatch.setattr(database, "LocalStorageManager", FakeLocalStorage)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "conversations.db")
+
+
+@pytest.fixture
+def db(db_path):
+    conversation_db = database.ConversationDB(user_id="user", db_path=db_path)
+    yield conversation_db
+    conversation_db.close()
@@ -0,0 +1,296 @@
+import sqlite3
+import time
+
+import pytest
+
+from utils import database
+
+# Schema created by the first release, before user_version was set
+_BASELINE_SCHEMA = """
+CREATE TABLE conversations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    session_id TEXT,
+    name TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    UNIQUE(user_id, session_id)
+);
+CREATE TABLE messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    session_id TEXT,
+    role TEXT,
+    content TEXT,
+    timestamp TEXT,
+    FOREIGN KEY(session_id) REFERENCES conversations(session_id)
+);
+CREATE TABLE files (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    session_id TEXT,
+    file_path TEXT UNIQUE,
+    file_name TEXT,
+    uploaded_at TEXT,
+    FOREIGN KEY(session_id) REFERENCES conversations(session_id),
+    UNIQUE(session_id, file_name)
+);
+CREATE INDEX idx_messages_session_id ON messages(session_id);
+CREATE INDEX idx_files_session_id ON files(session_id);
+CREATE TABLE notes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    title TEXT,
+    content TEXT,
+    file_path TEXT UNIQUE,
+    file_type TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    conversation_id TEXT,
+    FOREIGN KEY(conversation_id) REFERENCES conversations(session_id)
+);
+CREATE INDEX idx_files_path ON files(file_path);
+"""
+
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_migrates_baseline_database(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.executescript(_BASELINE_SCHEMA)
+    conn.execute(
+        "INSERT INTO conversations (user_id, session_id, name, created_at) "
+        "VALUES ('user', 's1', 'Old', '2024-01-01T09:00:00')"
+    )
+    conn.executemany(
+        "INSERT INTO messages (user_id, session_id, role, content, timestamp) "
+        "VALUES ('user', 's1', ?, ?, ?)",
+        [
+            ("user", "second", "2024-01-01T10:00:00.5"),
+            ("user", "first", "2024-01-01T10:00:00"),
+            ("assistant", "third", "2024-01-01T10:00:01"),
+        ],
+    )
+    conn.execute(
+        "INSERT INTO files (user_id, session_id, file_path, file_name, uploaded_at) "
+        "VALUES ('user', 's1', 'uploads/s1/a.txt', 'a.txt', '2024-01-01T10:00:00')"
+    )
+    conn.execute(
+        "INSERT INTO notes (user_id, title, content, file_path, conversation_id) "
+        "VALUES ('user', 'Note', 'text', 'notes/n.md', 's1')"
+    )
+    conn.commit()
+    conn.close()
+
+    db = database.ConversationDB(user_id="user", db_path=db_path)
+    try:
+        assert db.conn.execute("PRAGMA user_version").fetchone()[0] == 7
+        assert db.conn.execute("PRAGMA foreign_key_check").fetchall() == []
+        assert [content for _, content, _ in db.get_messages("s1")] == [
+            "first",
+            "second",
+            "third",
+        ]
+        assert db.conn.execute(
+            "SELECT message_count, file_count FROM conversations"
+        ).fetchone() == (3, 1)
+        assert len(db.get_notes()) == 1
+        indexes = {
+            name
+            for (name,) in db.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index'"
+            )
+        }
+        assert "idx_messages_session_id" not in indexes
+        assert "idx_messages_user_sess_us" in indexes
+        # Statistics are gathered after the old rows are copied back in
+        stats = dict(
+            db.conn.execute("SELECT idx, stat FROM sqlite_stat1 WHERE tbl = 'messages'")
+        )
+        assert stats["idx_messages_user_sess_us"].split()[0] == "3"
+    finally:
+        db.close()
+
+    # A current database is opened without running the migration again
+    db = database.ConversationDB(user_id="user", db_path=db_path)
+    try:
+        assert len(db.get_messages("s1")) == 3
+    finally:
+        db.close()
+
+
+def test_flush_writes_queued_messages_in_order(db):
+    session_id = db.create_conversation()
+    assert db.add_message(session_id, "user", "one")
+    assert db.add_messages(session_id, [("assistant", "two"), ("user", "three")])
+    assert db.add_message(session_id, "assistant", "four")
+    assert db.flush()
+
+    rows = db.conn.execute(
+        "SELECT role, content FROM messages ORDER BY ts_us"
+    ).fetchall()
+    assert rows == [
+        ("user", "one"),
+        ("assistant", "two"),
+        ("user", "three"),
+        ("assistant", "four"),
+    ]
+    assert [content for _, content, _ in db.get_messages(session_id)] == [
+        "one",
+        "two",
+        "three",
+        "four",
+    ]
+
+
+def test_add_messages_rejects_missing_conversation(db):
+    assert not db.add_message("session_missing", "user", "hello")
+    assert db.flush()
+
+
+def test_flush_reports_messages_the_writer_rejected(db, db_path):
+    kept = db.create_conversation()
+    dropped = db.create_conversation()
+
+    # Hold the writer back while another connection deletes the conversation,
+    # so the queued rows fail the foreign key once they are written
+    with db._lock:
+        assert db.add_message(kept, "user", "kept")
+        assert db.add_message(dropped, "user", "dropped")
+        other = sqlite3.connect(db_path, timeout=5)
+        other.execute("DELETE FROM conversations WHERE session_id = ?", (dropped,))
+        other.commit()
+        other.close()
+
+    assert not db.flush()
+    # Failures are reported once
+    assert db.flush()
+    assert [content for _, content, _ in db.get_messages(kept)] == ["kept"]
+    assert db.get_messages(dropped) == []
+
+
+def test_add_messages_after_close(db):
+    session_id = db.create_conversation()
+    db.close()
+    assert not db.add_message(session_id, "user", "late")
+    assert db.flush()
+
+
+def test_delete_conversation_cascades_and_removes_files(db, db_path, tmp_path):
+    session_id = db.create_conversation()
+    other_id = db.create_conversation()
+    upload_dir = tmp_path / "uploads" / session_id
+    upload_dir.mkdir(parents=True)
+    upload = upload_dir / "a.txt"
+    upload.write_text("content")
+    assert db.add_file(session_id, str(upload), "a.txt")
+    db.add_messages(session_id, [("user", "question"), ("assistant", "answer")])
+    db.add_message(other_id, "user", "elsewhere")
+    db.add_note("Note", "text", str(tmp_path / "note.md"), "md", session_id)
+
+    assert db.delete_conversation(session_id)
+
+    # A connection of its own, as the cleanup worker writes through db.conn
+    count = sqlite3.connect(db_path).execute
+    assert count(
+        "SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)
+    ).fetchone() == (0,)
+    assert count(
+        "SELECT COUNT(*) FROM files WHERE session_id = ?", (session_id,)
+    ).fetchone() == (0,)
+    assert [row[0] for row in db.get_conversations()] == [other_id]
+    assert len(db.get_messages(other_id)) == 1
+    # Notes outlive their conversation
+    assert len(db.get_notes()) == 1
+
+    # The background worker unlinks the file and drains the queue
+    assert _wait_until(lambda: not upload.exists())
+    assert _wait_until(
+        lambda: count("SELECT COUNT(*) FROM deleted_files").fetchone() == (0,)
+    )
+
+
+def test_failed_migration_rolls_back(db):
+    # Claims schema 6, so the migration adds ts_us a second time and fails
+    with db._lock:
+        db.conn.execute("PRAGMA user_version = 6")
+    with pytest.raises(sqlite3.OperationalError):
+        db._create_table()
+
+    assert not db.conn.in_transaction
+    assert db.conn.execute("PRAGMA user_version").fetchone()[0] == 6
+    assert db.create_conversation() is not None
+
+
+def test_messages_ordered_by_time_after_adding_ts_us(db_path):
+    # Schema 6 tables, which predate the ts_us column
+    conn = sqlite3.connect(db_path)
+    conn.executescript(
+        """
+        CREATE TABLE conversations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            session_id TEXT,
+            name TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            file_count INTEGER NOT NULL DEFAULT 0,
+            UNIQUE(user_id, session_id)
+        );
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            session_id TEXT,
+            role TEXT,
+            content TEXT,
+            timestamp TEXT,
+            FOREIGN KEY(user_id, session_id) REFERENCES conversations(user_id, session_id)
+                ON DELETE CASCADE
+        );
+        INSERT INTO conversations (user_id, session_id, message_count)
+        VALUES ('user', 's1', 4);
+        PRAGMA user_version = 6;
+        """
+    )
+    # isoformat() drops the fraction on whole seconds, so the text order of
+    # these timestamps is not their time order
+    timestamps = [
+        "2024-01-01T10:00:00.5",
+        "2024-01-01T10:00:00",
+        "2024-01-01T09:59:59.999999",
+        "2024-01-01T10:00:00.000002",
+    ]
+    conn.executemany(
+        "INSERT INTO messages (user_id, session_id, role, content, timestamp) "
+        "VALUES ('user', 's1', 'user', ?, ?)",
+        [(ts, ts) for ts in timestamps],
+    )
+    conn.commit()
+    conn.close()
+
+    db = database.ConversationDB(user_id="user", db_path=db_path)
+    try:
+        assert db.conn.execute("PRAGMA user_version").fetchone()[0] == 7
+        assert [ts for _, _, ts in db.get_messages("s1")] == [
+            "2024-01-01T09:59:59.999999",
+            "2024-01-01T10:00:00",
+            "2024-01-01T10:00:00.000002",
+            "2024-01-01T10:00:00.5",
+        ]
+        # Messages are still deleted by their timestamp text
+        assert db.delete_message("s1", "2024-01-01T10:00:00")
+        assert [ts for _, _, ts in db.get_messages("s1")] == [
+            "2024-01-01T09:59:59.999999",
+            "2024-01-01T10:00:00.000002",
+            "2024-01-01T10:00:00.5",
+        ]
+    finally:
+        db.close()
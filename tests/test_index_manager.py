@@ -0,0 +1,327 @@
+import json
+import os
+import pickle
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("llama_index.core")
+
+from utils import database, index_manager  # noqa: E402
+
+
+@pytest.fixture
+def session_db(tmp_path, monkeypatch):
+    # IndexManager keeps its storage and cache under the working directory
+    monkeypatch.chdir(tmp_path)
+    conversation_db = database.get_db("user")
+    yield conversation_db
+    conversation_db.close()
+
+
+@pytest.fixture
+def session_id(session_db):
+    return session_db.create_conversation()
+
+
+@pytest.fixture
+def manager(session_id, monkeypatch):
+    # Hashed embeddings, so tests neither download nor run a model
+    monkeypatch.setattr(
+        index_manager,
+        "_load_embed_model",
+        lambda model_name, cache_folder: index_manager.BasicEmbedding(),
+    )
+    index = index_manager.IndexManager(session_id=session_id, user_id="user")
+    yield index
+    index.close()
+
+
+def _upload(session_db, session_id, name, text):
+    """Write an upload the way the app does, renamed into place, and register it"""
+    path = os.path.join("data", "uploads", session_id, name)
+    partial_path = os.path.join("data", "uploads", f".{session_id}.{name}.part")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(partial_path, "w") as f:
+        f.write(text)
+    os.replace(partial_path, path)
+    session_db.add_file(session_id, path, name)
+    return path
+
+
+def test_read_file_parses_json_structure(tmp_path):
+    note = "quarterly revenue grew " * 30
+    path = tmp_path / "report.json"
+    path.write_text(json.dumps({"section": {"note": note}}))
+
+    docs = index_manager._read_file(str(path), os.stat(path))
+
+    assert len(docs) == 1
+    # JSONReader flattens to key paths rather than keeping the raw JSON text
+    assert f"section note {note}" in docs[0].text
+    assert "{" not in docs[0].text
+    assert docs[0].metadata["file_category"] == "data"
+
+
+def test_read_file_reports_unreadable_json(tmp_path):
+    path = tmp_path / "broken.json"
+    path.write_text("{not json")
+
+    assert index_manager._read_file(str(path), os.stat(path)) == []
+
+
+def test_remove_file_drops_only_its_documents(session_db, session_id, manager):
+    kept = _upload(session_db, session_id, "kept.txt", "Apples grow on trees.")
+    removed = _upload(session_db, session_id, "removed.txt", "Bananas grow in bunches.")
+    copy = _upload(session_db, session_id, "copy.txt", "Apples grow on trees.")
+    manager.build_index(force=True)
+    file_doc_ids = dict(manager._embedding_cache["file_doc_ids"])
+    # Identical uploads share one document
+    assert file_doc_ids[kept] == file_doc_ids[copy]
+    indexed = set(manager.index.ref_doc_info)
+
+    session_db.delete_file(session_id, removed)
+    assert manager.remove_file(removed)
+    assert set(manager.index.ref_doc_info) == indexed - set(file_doc_ids[removed])
+    assert removed not in manager._embedding_cache["file_doc_ids"]
+
+    # A document stays while another upload still holds its text
+    session_db.delete_file(session_id, kept)
+    assert manager.remove_file(kept)
+    assert set(file_doc_ids[copy]) <= set(manager.index.ref_doc_info)
+
+    # The removal is persisted as current, so it is not rebuilt
+    manager._wait_for_persist()
+    assert manager._index_is_current()
+
+
+def test_fingerprint_follows_upload_content(session_db, session_id, manager):
+    path = _upload(session_db, session_id, "notes.txt", "First draft.")
+    manager.build_index(force=True)
+    manager._wait_for_persist()
+    assert manager.fingerprint_file.read_text() == manager._index_fingerprint
+    assert manager._index_is_current()
+
+    # A new modification time with the same bytes is not a change
+    stats = os.stat(path)
+    os.utime(path, ns=(stats.st_atime_ns, stats.st_mtime_ns + 10**9))
+    assert manager._index_is_current()
+
+    # A new manager compares against the persisted fingerprint
+    fresh = index_manager.IndexManager(session_id=session_id, user_id="user")
+    try:
+        assert fresh._index_is_current()
+        _upload(session_db, session_id, "notes.txt", "Second draft.")
+        assert not fresh._index_is_current()
+        assert not manager._index_is_current()
+    finally:
+        fresh.close()
+
+
+@pytest.mark.parametrize("orjson_installed", [True, False], ids=["orjson", "json"])
+def test_float16_vector_store_round_trip(orjson_installed, tmp_path, monkeypatch):
+    from llama_index.core.schema import TextNode
+    from llama_index.core.vector_stores import VectorStoreQuery
+
+    if orjson_installed:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setitem(sys.modules, "orjson", None)
+    vectors = index_manager.BasicEmbedding(quantization="fp32")._hash_texts(
+        ["alpha", "beta", "gamma"]
+    )
+    store = index_manager.Float16VectorStore()
+    store.add(
+        [
+            TextNode(id_=f"node-{i}", text=text, embedding=vector.tolist())
+            for i, (text, vector) in enumerate(zip(["alpha", "beta", "gamma"], vectors))
+        ]
+    )
+    persist_path = tmp_path / "storage" / "default__vector_store.json"
+    store.persist(str(persist_path))
+
+    # Vectors live in the matrix file only, at half precision
+    assert "embedding_dict" not in json.loads(persist_path.read_text())
+    assert np.load(persist_path.with_suffix(".npy")).dtype == np.float16
+
+    loaded = index_manager.Float16VectorStore.from_persist_path(str(persist_path))
+    assert list(loaded.data.embedding_dict) == ["node-0", "node-1", "node-2"]
+    for node_id, vector in zip(loaded.data.embedding_dict, vectors):
+        assert np.allclose(loaded.get(node_id), vector, atol=1e-3)
+    assert loaded.data.text_id_to_ref_doc_id == store.data.text_id_to_ref_doc_id
+
+    result = loaded.query(
+        VectorStoreQuery(query_embedding=vectors[1].tolist(), similarity_top_k=1)
+    )
+    assert result.ids == ["node-1"]
+
+
+def test_chunk_vector_cache_round_trip(manager):
+    texts = ["first chunk", "second chunk"]
+    vectors = index_manager.BasicEmbedding(quantization="fp32")._hash_texts(texts)
+    keys = [index_manager._content_key(text) for text in texts]
+    manager._embedding_cache["chunk_vectors"] = dict(zip(keys, vectors))
+    manager._embedding_cache["chunk_vectors_model"] = manager.model_name
+    manager._save_caches()
+
+    manager._load_caches()
+    cached = manager._embedding_cache["chunk_vectors"]
+    assert list(cached) == keys
+    for key, vector in zip(keys, vectors):
+        assert cached[key].dtype == np.float16
+        assert np.allclose(cached[key], vector, atol=1e-3)
+    assert manager._embedding_cache["chunk_vectors_model"] == manager.model_name
+
+    # A build that embedded nothing leaves no stale matrix behind
+    manager._embedding_cache["chunk_vectors"] = {}
+    manager._save_caches()
+    assert not manager.chunk_vectors_file.exists()
+    manager._load_caches()
+    assert "chunk_vectors" not in manager._embedding_cache
+
+
+def test_build_query_and_reload(session_db, session_id, manager):
+    _upload(session_db, session_id, "fruit.txt", "Apples grow on trees.")
+    _upload(session_db, session_id, "veg.txt", "Carrots grow underground.")
+    manager.build_index(force=True)
+    assert manager.index is not None
+
+    nodes = manager.query_index("Where do apples grow?", top_k=2)
+    assert len(nodes) == 2
+
+    # A new session loads the persisted index instead of rebuilding it
+    manager._wait_for_persist()
+    fresh = index_manager.IndexManager(session_id=session_id, user_id="user")
+    try:
+        fresh.index = None
+        fresh.load_index()
+        assert fresh._index_build_thread is None
+        assert isinstance(fresh.index.vector_store, index_manager.Float16VectorStore)
+        assert len(fresh.query_index("Where do apples grow?", top_k=2)) == 2
+    finally:
+        fresh.close()
+
+    # Pickling the index into the cache leaves the model usable for a rebuild
+    _upload(session_db, session_id, "nuts.txt", "Walnuts grow on trees too.")
+    manager.build_index(force=True)
+    texts = {doc.text for doc in manager.index.docstore.docs.values()}
+    assert "Walnuts grow on trees too." in texts
+
+
+def test_rebuild_parses_only_changed_uploads(
+    session_db, session_id, manager, monkeypatch
+):
+    read_paths = []
+    read_file = index_manager._read_file
+
+    def recording_read_file(path, stats=None):
+        read_paths.append(path)
+        return read_file(path, stats)
+
+    monkeypatch.setattr(index_manager, "_read_file", recording_read_file)
+    first = _upload(session_db, session_id, "first.txt", "Unchanged text.")
+    second = _upload(session_db, session_id, "second.txt", "Old text.")
+    manager.build_index(force=True)
+    assert sorted(read_paths) == sorted([first, second])
+
+    read_paths.clear()
+    _upload(session_db, session_id, "second.txt", "New text.")
+    manager.build_index(force=True)
+    assert read_paths == [second]
+    texts = {doc.text for doc in manager.index.docstore.docs.values()}
+    assert "New text." in texts
+    assert "Old text." not in texts
+
+
+def _embedded_nodes(count):
+    from llama_index.core.schema import TextNode
+
+    vectors = np.random.default_rng(0).standard_normal((count, 384), np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return [
+        TextNode(text=f"chunk {i}", embedding=vector.tolist())
+        for i, vector in enumerate(vectors)
+    ]
+
+
+def test_small_sessions_skip_faiss(manager):
+    assert manager._faiss_storage_context(_embedded_nodes(10)) is None
+
+
+def test_faiss_missing_falls_back(manager, monkeypatch):
+    monkeypatch.setitem(sys.modules, "faiss", None)
+    nodes = _embedded_nodes(index_manager._FAISS_MIN_NODES)
+    assert manager._faiss_storage_context(nodes) is None
+
+
+def test_faiss_index_for_large_sessions(manager):
+    pytest.importorskip("faiss")
+    pytest.importorskip("llama_index.vector_stores.faiss")
+    nodes = _embedded_nodes(index_manager._FAISS_MIN_NODES)
+
+    storage_context = manager._faiss_storage_context(nodes)
+    faiss_index = storage_context.vector_store.client
+    assert faiss_index.is_trained
+
+    index_manager.VectorStoreIndex(
+        nodes, storage_context=storage_context, embed_model=manager.embed_model
+    )
+    assert faiss_index.ntotal == len(nodes)
+
+
+@pytest.fixture(params=[True, False], ids=["xxhash", "hashlib"])
+def xxhash_installed(request, monkeypatch):
+    if request.param:
+        pytest.importorskip("xxhash")
+    else:
+        # A None entry makes the import raise ImportError
+        monkeypatch.setitem(sys.modules, "xxhash", None)
+    return request.param
+
+
+def test_hash_embeddings(xxhash_installed):
+    embedding = index_manager.BasicEmbedding(quantization="fp32")
+    vectors = embedding._hash_texts(["alpha", "beta", "alpha"])
+    assert vectors.shape == (3, 384)
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+    assert np.array_equal(vectors[0], vectors[2])
+    assert not np.array_equal(vectors[0], vectors[1])
+    assert embedding._get_query_embedding("alpha") == vectors[0].tolist()
+
+
+def test_content_key(xxhash_installed):
+    key = index_manager._content_key("some text")
+    assert len(key) == 16
+    assert key == index_manager._content_key("some text")
+    assert key != index_manager._content_key("other text")
+
+
+def test_file_digest(xxhash_installed, tmp_path):
+    paths = [tmp_path / name for name in ("a.txt", "b.txt", "c.txt", "empty.txt")]
+    for path, text in zip(paths, ["same", "same", "different", ""]):
+        path.write_text(text)
+    digests = [index_manager._file_digest(str(path)) for path in paths]
+    assert digests[0] == digests[1]
+    assert digests[0] != digests[2]
+    assert digests[3] == ""
+
+
+@pytest.mark.parametrize("lz4_installed", [True, False], ids=["lz4", "plain"])
+def test_cache_pickle_round_trip(lz4_installed, tmp_path, monkeypatch):
+    if lz4_installed:
+        pytest.importorskip("lz4.frame")
+    else:
+        monkeypatch.setitem(sys.modules, "lz4", None)
+        monkeypatch.setitem(sys.modules, "lz4.frame", None)
+    path = tmp_path / "embeddings.pkl"
+    data = {"file_doc_ids": {"a.txt": ["doc"] * 100}}
+
+    with index_manager._cache_writer(path) as f:
+        pickle.dump(data, f)
+    with open(path, "rb") as f:
+        magic = f.read(len(index_manager._LZ4_MAGIC))
+    assert (magic == index_manager._LZ4_MAGIC) == lz4_installed
+
+    with index_manager._cache_reader(path) as f:
+        assert pickle.load(f) == data
@@ -1,31 +1,471 @@
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 import logging
+import queue
+import re
 import threading
+import time
+import uuid
+from contextlib import contextmanager
+from itertools import chain
 from pathlib import Path
 from .local_storage import LocalStorageManager
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# How often the idle maintenance pass lets SQLite re-analyze tables
+_OPTIMIZE_INTERVAL = 7 * 24 * 60 * 60
 
-class ConversationDB:
-    _instance = None
-    _lock = threading.Lock()
+# Leading phrases stripped from a conversation's first question, in the
+# order they may appear, e.g. "please explain ..."
+_STARTER_RE = re.compile(
+    r"^(?:what is\s*)?(?:how to\s*)?(?:can you\s*)?(?:please\s*)?"
+    r"(?:tell me about\s*)?(?:explain\s*)?",
+    re.IGNORECASE,
+)
+_WORD_RE = re.compile(r"\S+")
+
+# Bump whenever _SCHEMA_SQL changes so existing databases re-run the DDL
+_SCHEMA_VERSION = 7
+
+# An ISO timestamp as integer epoch microseconds. Messages keep their ISO
+# timestamp as their identity, and this virtual column derived from it is
+# what the indexes store and order by: an 8 byte integer instead of a
+# 26 character string
+_TS_US_SQL = (
+    "CAST(strftime('%s', substr({0}, 1, 19)) AS INTEGER) * 1000000"
+    " + CAST(substr(substr({0}, 21) || '000000', 1, 6) AS INTEGER)"
+)
+_TS_US_COLUMN = (
+    f"ts_us INTEGER GENERATED ALWAYS AS ({_TS_US_SQL.format('timestamp')}) VIRTUAL"
+)
+
+_SCHEMA_SQL = f"""
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    session_id TEXT,
+    name TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    file_count INTEGER NOT NULL DEFAULT 0,
+    UNIQUE(user_id, session_id)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    session_id TEXT,
+    role TEXT,
+    content TEXT,
+    timestamp TEXT,
+    {_TS_US_COLUMN},
+    FOREIGN KEY(user_id, session_id) REFERENCES conversations(user_id, session_id)
+        ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    session_id TEXT,
+    file_path TEXT UNIQUE,
+    file_name TEXT,
+    uploaded_at TEXT,
+    FOREIGN KEY(user_id, session_id) REFERENCES conversations(user_id, session_id)
+        ON DELETE CASCADE,
+    UNIQUE(session_id, file_name)
+);
+-- Notes outlive their conversation, so conversation_id is not a foreign key
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    title TEXT,
+    content TEXT,
+    file_path TEXT UNIQUE,
+    file_type TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    conversation_id TEXT
+);
+-- Files of deleted conversations, unlinked from disk by a background worker
+CREATE TABLE IF NOT EXISTS deleted_files (
+    file_path TEXT PRIMARY KEY,
+    queued_at TEXT
+);
+-- Superseded by the user_id-leading indexes below; files.file_path is
+-- already indexed by its UNIQUE constraint
+DROP INDEX IF EXISTS idx_messages_session_id;
+DROP INDEX IF EXISTS idx_messages_sess_ts;
+DROP INDEX IF EXISTS idx_messages_sess_role_ts;
+DROP INDEX IF EXISTS idx_messages_user_sess_ts;
+DROP INDEX IF EXISTS idx_messages_user_sess_role_ts;
+DROP INDEX IF EXISTS idx_files_session_id;
+DROP INDEX IF EXISTS idx_files_sess_path;
+DROP INDEX IF EXISTS idx_files_path;
+-- Composite indexes matching the (user_id, session_id) predicates, so history
+-- is read in timestamp order, the first user message is a single seek and
+-- listings come back in their ORDER BY order without a sort
+CREATE INDEX IF NOT EXISTS idx_messages_user_sess_us
+    ON messages(user_id, session_id, ts_us);
+CREATE INDEX IF NOT EXISTS idx_messages_user_sess_role_us
+    ON messages(user_id, session_id, role, ts_us);
+CREATE INDEX IF NOT EXISTS idx_files_user_sess
+    ON files(user_id, session_id, uploaded_at);
+CREATE INDEX IF NOT EXISTS idx_conversations_user_created
+    ON conversations(user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_notes_user_created ON notes(user_id, created_at);
+-- Keep the per-conversation counters in step with messages and files
+CREATE TRIGGER IF NOT EXISTS trg_messages_insert AFTER INSERT ON messages BEGIN
+    UPDATE conversations SET message_count = message_count + 1
+    WHERE user_id = NEW.user_id AND session_id = NEW.session_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_messages_delete AFTER DELETE ON messages BEGIN
+    UPDATE conversations SET message_count = message_count - 1
+    WHERE user_id = OLD.user_id AND session_id = OLD.session_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_files_insert AFTER INSERT ON files BEGIN
+    UPDATE conversations SET file_count = file_count + 1
+    WHERE user_id = NEW.user_id AND session_id = NEW.session_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_files_delete AFTER DELETE ON files BEGIN
+    UPDATE conversations SET file_count = file_count - 1
+    WHERE user_id = OLD.user_id AND session_id = OLD.session_id;
+END;
+PRAGMA user_version = {_SCHEMA_VERSION};
+"""
+
+# _create_table runs BEGIN; <prefixes> _SCHEMA_SQL <suffixes> ANALYZE; COMMIT;
+# where the prefixes and suffixes migrate databases created by older versions.
+# ANALYZE comes last so the planner statistics count the migrated rows
+
+# Databases older than schema 4 declared foreign keys on session_id alone,
+# which is not unique, so they are rebuilt with the composite cascading keys.
+# The old tables are renamed out of the way and _SCHEMA_SQL recreates them.
+_REBUILD_PREFIX_SQL = """
+DROP INDEX IF EXISTS idx_messages_session_id;
+DROP INDEX IF EXISTS idx_messages_sess_ts;
+DROP INDEX IF EXISTS idx_messages_sess_role_ts;
+DROP INDEX IF EXISTS idx_files_session_id;
+DROP INDEX IF EXISTS idx_files_path;
+DROP INDEX IF EXISTS idx_files_sess_path;
+ALTER TABLE messages RENAME TO _messages_old;
+ALTER TABLE files RENAME TO _files_old;
+ALTER TABLE notes RENAME TO _notes_old;
+"""
+
+_REBUILD_SUFFIX_SQL = """
+INSERT INTO messages (id, user_id, session_id, role, content, timestamp)
+SELECT id, user_id, session_id, role, content, timestamp FROM _messages_old;
+INSERT INTO files (id, user_id, session_id, file_path, file_name, uploaded_at)
+SELECT id, user_id, session_id, file_path, file_name, uploaded_at FROM _files_old;
+INSERT INTO notes
+(id, user_id, title, content, file_path, file_type, created_at, updated_at, conversation_id)
+SELECT id, user_id, title, content, file_path, file_type, created_at, updated_at,
+    conversation_id
+FROM _notes_old;
+DROP TABLE _messages_old;
+DROP TABLE _files_old;
+DROP TABLE _notes_old;
+"""
+
+# Schema 5 adds the message and file counters maintained by triggers
+_COUNTERS_PREFIX_SQL = """
+ALTER TABLE conversations ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE conversations ADD COLUMN file_count INTEGER NOT NULL DEFAULT 0;
+"""
+
+_COUNTERS_SUFFIX_SQL = """
+UPDATE conversations SET
+    message_count = (
+        SELECT COUNT(*) FROM messages m
+        WHERE m.user_id = conversations.user_id
+        AND m.session_id = conversations.session_id
+    ),
+    file_count = (
+        SELECT COUNT(*) FROM files f
+        WHERE f.user_id = conversations.user_id
+        AND f.session_id = conversations.session_id
+    );
+"""
+
+# Schema 7 adds the integer timestamp column to tables that were not rebuilt
+_TS_US_PREFIX_SQL = f"""
+ALTER TABLE messages ADD COLUMN {_TS_US_COLUMN};
+"""
+
+
+# Statements are kept as module-level constants so every call passes the
+# same SQL text and hits the connection's prepared statement cache
+
+# Prepared statements kept per connection, well above the number of distinct
+# statements below so none of them is ever evicted and re-parsed
+_CACHED_STATEMENTS = 256
+
+# Local time in the same ISO format as datetime.isoformat(), computed by SQLite
+_SQL_NOW = "strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')"
+_SQL_HAS_MESSAGES_TABLE = (
+    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages'"
+)
+
+_SQL_GET_SESSION_IDS = "SELECT session_id FROM conversations WHERE user_id = ?"
+
+# Merges insert full batches with one multi-row VALUES statement and the
+# remainder row by row
+_MERGE_BATCH_SIZE = 100
+
+_SQL_MERGE_MESSAGE_HEAD = """
+    INSERT OR IGNORE INTO messages (user_id, session_id, role, content, timestamp)
+    VALUES
+"""
+_MESSAGE_ROW = "(?, ?, ?, ?, ?)"
+_SQL_MERGE_MESSAGE = _SQL_MERGE_MESSAGE_HEAD + _MESSAGE_ROW
+_SQL_MERGE_MESSAGE_BATCH = _SQL_MERGE_MESSAGE_HEAD + ", ".join(
+    [_MESSAGE_ROW] * _MERGE_BATCH_SIZE
+)
+
+_SQL_MERGE_NOTE_HEAD = """
+    INSERT OR IGNORE INTO notes
+    (user_id, title, content, file_path, file_type, created_at, updated_at, conversation_id)
+    VALUES
+"""
+_NOTE_ROW = "(?, ?, ?, ?, ?, ?, ?, ?)"
+_SQL_MERGE_NOTE = _SQL_MERGE_NOTE_HEAD + _NOTE_ROW
+_SQL_MERGE_NOTE_BATCH = _SQL_MERGE_NOTE_HEAD + ", ".join(
+    [_NOTE_ROW] * _MERGE_BATCH_SIZE
+)
+
+_SQL_GET_QUEUED_FILES = "SELECT file_path FROM deleted_files"
+
+_SQL_DEQUEUE_FILE = "DELETE FROM deleted_files WHERE file_path = ?"
+
+_SQL_CREATE_CONVERSATION = f"""
+    INSERT INTO conversations (user_id, session_id, name, created_at, updated_at)
+    VALUES (?, ?, ?, {_SQL_NOW}, {_SQL_NOW})
+"""
+
+_SQL_UPDATE_CONVERSATION_NAME = f"""
+    UPDATE conversations
+    SET name = ?, updated_at = {_SQL_NOW}
+    WHERE user_id = ? AND session_id = ?
+"""
+
+_SQL_GET_CONVERSATION_NAME = (
+    "SELECT name FROM conversations WHERE user_id = ? AND session_id = ?"
+)
+
+_SQL_GET_FIRST_USER_MESSAGE = """
+    SELECT content
+    FROM messages
+    WHERE user_id = ? AND session_id = ? AND role = 'user'
+    ORDER BY ts_us ASC LIMIT 1
+"""
+
+_SQL_ADD_MESSAGE = """
+    INSERT INTO messages (user_id, session_id, role, content, timestamp)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+_SQL_ADD_FILE = f"""
+    INSERT OR IGNORE INTO files (user_id, session_id, file_path, file_name, uploaded_at)
+    VALUES (?, ?, ?, ?, {_SQL_NOW})
+"""
 
-    def __new__(cls, *args, **kwargs):
-        if cls._instance is None:
-            with cls._lock:
-                if cls._instance is None:
-                    cls._instance = super().__new__(cls)
-        return cls._instance
+_SQL_GET_CONVERSATIONS = """
+    SELECT session_id, created_at
+    FROM conversations
+    WHERE user_id = ?
+    ORDER BY created_at DESC
+"""
 
+# The counters are maintained by triggers; file names are only looked up
+# for conversations that have files
+_SQL_GET_CONVERSATION_DETAILS = """
+    SELECT
+        c.session_id,
+        c.created_at,
+        c.message_count,
+        c.file_count,
+        CASE WHEN c.file_count > 0 THEN (
+            SELECT GROUP_CONCAT(f.file_name)
+            FROM files f
+            WHERE f.user_id = c.user_id AND f.session_id = c.session_id
+        ) END as files
+    FROM conversations c
+    WHERE c.user_id = ?
+    ORDER BY c.created_at DESC
+"""
+
+_SQL_GET_MESSAGES = "SELECT role, content, timestamp FROM messages WHERE user_id = ? AND session_id = ? ORDER BY ts_us"
+
+_SQL_GET_CONVERSATION_FILES = """
+    SELECT file_path, file_name
+    FROM files
+    WHERE user_id = ? AND session_id = ?
+    ORDER BY uploaded_at
+"""
+
+_SQL_QUEUE_CONVERSATION_FILES = f"""
+    INSERT OR IGNORE INTO deleted_files (file_path, queued_at)
+    SELECT file_path, {_SQL_NOW} FROM files WHERE user_id = ? AND session_id = ?
+"""
+
+# Messages and files are removed by ON DELETE CASCADE
+_SQL_DELETE_CONVERSATION = (
+    "DELETE FROM conversations WHERE user_id = ? AND session_id = ?"
+)
+
+_SQL_DELETE_FILE = """
+    DELETE FROM files WHERE user_id = ? AND session_id = ? AND file_path = ?
+    RETURNING file_path
+"""
+
+# Saving a note again overwrites it, but never a note owned by another user
+_SQL_ADD_NOTE = """
+    INSERT INTO notes (user_id, title, content, file_path, file_type, created_at, updated_at, conversation_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(file_path) DO UPDATE
+    SET title = excluded.title, content = excluded.content, updated_at = excluded.updated_at
+    WHERE notes.user_id = excluded.user_id
+"""
+
+_SQL_GET_NOTES = """
+    SELECT title, content, file_path, file_type, created_at, conversation_id
+    FROM notes
+    WHERE user_id = ?
+    ORDER BY created_at DESC
+"""
+
+# Matching ts_us as well lets the delete seek the index to the message
+_SQL_DELETE_MESSAGE = f"""
+    DELETE FROM messages
+    WHERE user_id = ?1 AND session_id = ?2
+    AND ts_us = {_TS_US_SQL.format("?3")} AND timestamp = ?3
+"""
+
+_SQL_DELETE_NOTE = "DELETE FROM notes WHERE user_id = ? AND file_path = ?"
+
+_SQL_UPDATE_NOTE_TITLE = """
+    UPDATE notes
+    SET title = ?, updated_at = ?
+    WHERE user_id = ? AND file_path = ?
+    RETURNING content, file_type, conversation_id, created_at
+"""
+
+
+def _configure_connection(conn: sqlite3.Connection):
+    """Apply the per-connection PRAGMAs shared by the writer and the readers."""
+    # Set a 64MB cache so the conversation aggregates stay in memory
+    conn.execute("PRAGMA cache_size=-65536")
+    # Serve reads through a 256MB memory map instead of read() calls
+    conn.execute("PRAGMA mmap_size=268435456")
+    # Keep temporary tables and sort indices in memory
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+
+class _ConnPool:
+    """One writer connection plus a small pool of read-only connections.
+
+    WAL lets readers run alongside the single writer, so only writes are
+    serialized through ``write_lock``; reads borrow a connection of their own.
+    """
+
+    def __init__(self, db_path: str, size: int = 4):
+        self.writer = sqlite3.connect(
+            db_path, check_same_thread=False, cached_statements=_CACHED_STATEMENTS
+        )
+        # Use 4KB pages; only honoured before the database is first written
+        self.writer.execute("PRAGMA page_size=4096")
+        # Enable WAL (Write-Ahead Logging) for better concurrency and performance
+        self.writer.execute("PRAGMA journal_mode=WAL")
+        # Set the synchronization mode to normal for better performance, or
+        # skip fsync entirely when DOCUVERSE_UNSAFE_SYNC opts into it
+        if os.getenv("DOCUVERSE_UNSAFE_SYNC"):
+            self.writer.execute("PRAGMA synchronous=OFF")
+        else:
+            self.writer.execute("PRAGMA synchronous=NORMAL")
+        # Checkpoint the WAL every 1000 pages to avoid long stalls
+        self.writer.execute("PRAGMA wal_autocheckpoint=1000")
+        _configure_connection(self.writer)
+        self.write_lock = threading.Lock()
+
+        # Readers are opened lazily, after the writer has created the schema
+        self._uri = f"{Path(db_path).resolve().as_uri()}?mode=ro"
+        self._size = size
+        self._opened = 0
+        self._open_lock = threading.Lock()
+        self._readers = queue.SimpleQueue()
+
+    def _open_reader(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self._uri,
+            uri=True,
+            check_same_thread=False,
+            cached_statements=_CACHED_STATEMENTS,
+        )
+        _configure_connection(conn)
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """Borrow a read-only connection, blocking while all of them are in use."""
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._open_lock:
+                opened = self._opened < self._size
+                if opened:
+                    self._opened += 1
+            if opened:
+                try:
+                    conn = self._open_reader()
+                except sqlite3.Error:
+                    with self._open_lock:
+                        self._opened -= 1
+                    raise
+            else:
+                conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def close(self):
+        """Close the writer and every reader that has been returned to the pool."""
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self.write_lock:
+            self.writer.close()
+
+
+# Open databases by (user_id, db_path). Each holds two worker threads and up
+# to five connections, and is meant to last for the whole process; close()
+# removes it so the next get_db() opens a fresh one
+_instances: dict = {}
+_instances_lock = threading.Lock()
+
+
+def get_db(user_id: str, db_path: str = "data/conversations.db") -> "ConversationDB":
+    """Return the shared ConversationDB for a user, creating it on first use."""
+    with _instances_lock:
+        db = _instances.get((user_id, db_path))
+        if db is None:
+            db = _instances[(user_id, db_path)] = ConversationDB(
+                user_id=user_id, db_path=db_path
+            )
+        return db
+
+
+class ConversationDB:
     def __init__(self, user_id: str = None, db_path="data/conversations.db"):
         """Initialize the database connection, create necessary directories, and set up the database."""
         if not user_id:
             raise ValueError("user_id is required for database operations")
         self.user_id = user_id
+        self.db_path = db_path
 
         # Ensure the directory for the database exists
         db_directory = Path(db_path).parent
@@ -37,174 +477,269 @@ class ConversationDB:
                 logger.error(f"Error creating database directory: {e}")
                 raise
 
-        # Check if already initialized to avoid re-initialization
-        if not hasattr(self, "initialized"):
-            try:
-                # Establish the SQLite database connection
-                self.conn = sqlite3.connect(db_path, check_same_thread=False)
-                # Enable WAL (Write-Ahead Logging) for better concurrency and performance
-                self.conn.execute("PRAGMA journal_mode=WAL")
-                # Set the synchronization mode to normal for better performance
-                self.conn.execute("PRAGMA synchronous=NORMAL")
-                # Set a 2MB cache size for improved performance
-                self.conn.execute("PRAGMA cache_size=-2000")
-
-                # Lock for thread-safety
-                self._lock = threading.Lock()
-
-                # Create the necessary tables
-                self._create_table()
-
-                # Mark the initialization flag
-                self.initialized = True
-            except sqlite3.Error as e:
-                logger.error(f"Error initializing the database: {e}")
-                raise
+        try:
+            # Reads use pooled read-only connections; writes share one
+            # writer connection, kept as self.conn and guarded by self._lock
+            self._pool = _ConnPool(db_path)
+            self.conn = self._pool.writer
+            self._lock = self._pool.write_lock
+
+            # Create the necessary tables
+            self._create_table()
+            self._details_cache = None
+            self._name_cache: dict[str, str] = {}
+            # Enforce the cascading foreign keys; enabled after the schema
+            # rebuild, which must run with them off
+            self.conn.execute("PRAGMA foreign_keys=ON")
+
+            # Background worker that unlinks files queued in deleted_files and
+            # runs maintenance() once the app goes idle
+            self._maintained_changes = self.conn.total_changes
+            self._last_optimize = time.monotonic()
+            self._cleanup_event = threading.Event()
+            self._cleanup_stop = threading.Event()
+            self._cleanup_thread = threading.Thread(
+                target=self._cleanup_deleted_files, daemon=True
+            )
+            self._cleanup_thread.start()
+
+            # Background worker that commits queued messages in batches; flush()
+            # waits until everything queued so far is written and reports
+            # whether any of it failed. close() stops new messages being queued
+            self._write_queue = queue.SimpleQueue()
+            self._pending = 0
+            self._write_failures = 0
+            self._closed = False
+            self._pending_cond = threading.Condition()
+            self._writer_thread = threading.Thread(
+                target=self._write_messages, daemon=True
+            )
+            self._writer_thread.start()
+        except sqlite3.Error as e:
+            logger.error(f"Error initializing the database: {e}")
+            raise
 
         # Initialize local storage
         self.local_storage = LocalStorageManager()
 
-        # Sync with local storage if available
+        # Sessions are merged from local storage the first time they are read
+        self._session_ids = []
+        self._synced_sessions = set()
         self._sync_with_local_storage()
 
-    def _merge_stored_data(self, session_id: str, data_type: str, stored_data: list):
-        """Merge stored data into database."""
+    def _merge_stored_data(self, messages: list, notes: list):
+        """Merge stored message and note rows into the database in one transaction."""
         try:
             with self._lock:
-                cursor = self.conn.cursor()
-                if data_type == "chats":
-                    for msg in stored_data:
-                        cursor.execute(
-                            """INSERT OR IGNORE INTO messages 
-                            (user_id, session_id, role, content, timestamp)
-                            VALUES (?, ?, ?, ?, ?)""",
-                            (
-                                self.user_id,
-                                session_id,
-                                msg["role"],
-                                msg["content"],
-                                msg["timestamp"],
-                            ),
-                        )
-                elif data_type == "notes":
-                    for note in stored_data:
-                        cursor.execute(
-                            """INSERT OR IGNORE INTO notes
-                            (user_id, title, content, file_path, file_type, created_at, updated_at, conversation_id)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                            (
-                                self.user_id,
-                                note["title"],
-                                note["content"],
-                                note["file_path"],
-                                note["file_type"],
-                                note["created_at"],
-                                note["updated_at"],
-                                note.get("conversation_id"),
-                            ),
-                        )
-                self.conn.commit()
-                cursor.close()
+                # Take the write lock up front for the whole merge
+                self.conn.execute("BEGIN IMMEDIATE")
+                try:
+                    for rows, sql, batch_sql, table in (
+                        (
+                            messages,
+                            _SQL_MERGE_MESSAGE,
+                            _SQL_MERGE_MESSAGE_BATCH,
+                            "messages",
+                        ),
+                        (notes, _SQL_MERGE_NOTE, _SQL_MERGE_NOTE_BATCH, "notes"),
+                    ):
+                        changes = self.conn.total_changes
+                        full = len(rows) - len(rows) % _MERGE_BATCH_SIZE
+                        for start in range(0, full, _MERGE_BATCH_SIZE):
+                            batch = rows[start : start + _MERGE_BATCH_SIZE]
+                            self.conn.execute(
+                                batch_sql, list(chain.from_iterable(batch))
+                            )
+                        self.conn.executemany(sql, rows[full:])
+                        # Refresh planner statistics after a bulk merge
+                        if self.conn.total_changes > changes:
+                            self.conn.execute(f"ANALYZE {table}")
+                    self.conn.commit()
+                except Exception:
+                    self.conn.rollback()
+                    raise
         except Exception as e:
-            logger.error(f"Error merging {data_type}: {e}")
+            logger.error(f"Error merging stored data: {e}")
 
     def _sync_with_local_storage(self):
-        """Sync database with local storage per session."""
+        """Publish the user's sessions to local storage; their data is merged lazily."""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(
-                "SELECT session_id FROM conversations WHERE user_id = ?",
-                (self.user_id,),
-            )
-            sessions = cursor.fetchall()
-
-            for (session_id,) in sessions:
-                # Load session data
-                for data_type in ["notes", "chats", "files"]:
-                    key = f"{data_type}_{session_id}"
-                    stored_data = self.local_storage.load_data(key)
-                    if stored_data:
-                        self._merge_stored_data(session_id, data_type, stored_data)
+            with self._pool.reader() as conn:
+                self._session_ids = [
+                    session_id
+                    for (session_id,) in conn.execute(
+                        _SQL_GET_SESSION_IDS,
+                        (self.user_id,),
+                    )
+                ]
 
             # Save current sessions to local storage
             self.local_storage.save_data(
                 "user_sessions",
-                {"user_id": self.user_id, "sessions": [s[0] for s in sessions]},
+                {"user_id": self.user_id, "sessions": self._session_ids},
             )
-            cursor.close()
         except Exception as e:
             logger.error(f"Error syncing with local storage: {e}")
 
+    def _sync_sessions(self, session_ids):
+        """Merge the locally stored notes and chats of sessions not yet synced."""
+        pending = [sid for sid in session_ids if sid not in self._synced_sessions]
+        if not pending:
+            return
+        self._synced_sessions.update(pending)
+        messages, notes = [], []
+        try:
+            for session_id in pending:
+                for msg in self.local_storage.load_data(f"chats_{session_id}") or []:
+                    messages.append(
+                        (
+                            self.user_id,
+                            session_id,
+                            msg["role"],
+                            msg["content"],
+                            msg["timestamp"],
+                        )
+                    )
+                stored_notes = self.local_storage.load_data(f"notes_{session_id}") or []
+                # Notes are keyed by file path; older versions stored a list
+                if isinstance(stored_notes, dict):
+                    stored_notes = stored_notes.values()
+                for note in stored_notes:
+                    notes.append(
+                        (
+                            self.user_id,
+                            note["title"],
+                            note["content"],
+                            note["file_path"],
+                            note["file_type"],
+                            note["created_at"],
+                            note["updated_at"],
+                            note.get("conversation_id"),
+                        )
+                    )
+        except Exception as e:
+            logger.error(f"Error reading local storage for sync: {e}")
+            return
+        if messages or notes:
+            self._merge_stored_data(messages, notes)
+
+    def _cleanup_deleted_files(self, interval: float = 30.0):
+        """Remove queued files from disk and run maintenance when idle, until closed."""
+        while not self._cleanup_stop.is_set():
+            try:
+                with self._pool.reader() as conn:
+                    queued = conn.execute(_SQL_GET_QUEUED_FILES).fetchall()
+                for (file_path,) in queued:
+                    try:
+                        os.remove(file_path)
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        logger.error(f"Error deleting file {file_path}: {e}")
+                        continue
+                    with self._lock:
+                        self.conn.execute(
+                            _SQL_DEQUEUE_FILE,
+                            (file_path,),
+                        )
+                        self.conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Error cleaning up deleted files: {e}")
+            # A full interval without a wake-up means the app is idle
+            idle = not self._cleanup_event.wait(interval)
+            self._cleanup_event.clear()
+            if idle and self.conn.total_changes != self._maintained_changes:
+                self.maintenance()
+
+    def _write_messages(self, batch_size: int = 256):
+        """Commit queued messages in batches until a None sentinel arrives."""
+        while True:
+            rows = [self._write_queue.get()]
+            while len(rows) < batch_size:
+                try:
+                    rows.append(self._write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            # close() enqueues the sentinel last, so it can only end a batch
+            stop = rows[-1] is None
+            if stop:
+                rows.pop()
+            if rows:
+                failed = 0
+                try:
+                    with self._lock, self.conn:
+                        self.conn.executemany(_SQL_ADD_MESSAGE, rows)
+                except sqlite3.IntegrityError:
+                    # Retry row by row so one bad message does not drop the batch
+                    for row in rows:
+                        try:
+                            with self._lock, self.conn:
+                                self.conn.execute(_SQL_ADD_MESSAGE, row)
+                        except sqlite3.Error as e:
+                            logger.error(f"Error writing queued message: {e}")
+                            failed += 1
+                except sqlite3.Error as e:
+                    logger.error(f"Error writing queued messages: {e}")
+                    failed = len(rows)
+                with self._pending_cond:
+                    self._pending -= len(rows)
+                    self._write_failures += failed
+                    self._pending_cond.notify_all()
+            if stop:
+                return
+
+    def _wait_for_writes(self):
+        """Blocks until the writer has handled every queued message."""
+        with self._pending_cond:
+            self._pending_cond.wait_for(lambda: self._pending == 0)
+
+    def flush(self) -> bool:
+        """Blocks until every queued message is handled; False if any failed since the last flush."""
+        with self._pending_cond:
+            self._pending_cond.wait_for(lambda: self._pending == 0)
+            failed, self._write_failures = self._write_failures, 0
+        return failed == 0
+
+    def maintenance(self):
+        """Checkpoint the WAL into the database file and refresh statistics weekly."""
+        try:
+            with self._lock:
+                self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                if time.monotonic() - self._last_optimize >= _OPTIMIZE_INTERVAL:
+                    self.conn.execute("PRAGMA optimize")
+                    self._last_optimize = time.monotonic()
+                self._maintained_changes = self.conn.total_changes
+        except sqlite3.Error as e:
+            logger.error(f"Error running database maintenance: {e}")
+
     def _create_table(self):
+        """Create tables and indexes, skipping the DDL once the schema is current."""
         with self._lock:
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS conversations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL,
-                    session_id TEXT,
-                    name TEXT,
-                    created_at TEXT,
-                    updated_at TEXT,
-                    UNIQUE(user_id, session_id)
-                )
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL,
-                    session_id TEXT,
-                    role TEXT,
-                    content TEXT,
-                    timestamp TEXT,
-                    FOREIGN KEY(session_id) REFERENCES conversations(session_id)
-                )
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS files (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL,
-                    session_id TEXT,
-                    file_path TEXT UNIQUE,
-                    file_name TEXT,
-                    uploaded_at TEXT,
-                    FOREIGN KEY(session_id) REFERENCES conversations(session_id),
-                    UNIQUE(session_id, file_name)
-                )
-            """)
-            self.conn.commit()
-            # Create indexes for faster lookup on session_id
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages(session_id);"
-            )
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_files_session_id ON files(session_id);"
-            )
-            self.conn.commit()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS notes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL,
-                    title TEXT,
-                    content TEXT,
-                    file_path TEXT UNIQUE,
-                    file_type TEXT,
-                    created_at TEXT,
-                    updated_at TEXT,
-                    conversation_id TEXT,
-                    FOREIGN KEY(conversation_id) REFERENCES conversations(session_id)
+            cursor = self.conn.execute("PRAGMA user_version")
+            version = cursor.fetchone()[0]
+            if version >= _SCHEMA_VERSION:
+                return
+            prefix, suffix = "", ""
+            if self.conn.execute(_SQL_HAS_MESSAGES_TABLE).fetchone():
+                if version < 4:
+                    prefix += _REBUILD_PREFIX_SQL
+                    suffix += _REBUILD_SUFFIX_SQL
+                if version < 5:
+                    prefix += _COUNTERS_PREFIX_SQL
+                    suffix += _COUNTERS_SUFFIX_SQL
+                if 4 <= version < 7:
+                    prefix += _TS_US_PREFIX_SQL
+            # One script in one transaction, so the whole schema is a single commit
+            try:
+                self.conn.executescript(
+                    f"BEGIN;{prefix}{_SCHEMA_SQL}{suffix}ANALYZE;COMMIT;"
                 )
-            """)
-            self.conn.commit()
-
-            # Add index for file paths to speed up deletion queries
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_files_path 
-                ON files(file_path);
-            """)
-            self.conn.commit()
-
-            cursor.close()
+            except sqlite3.Error:
+                # A statement failed partway; an open transaction would make
+                # every later write on this connection fail too
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+                raise
 
     def create_conversation(self):
         """Creates a new conversation and returns its session ID."""
@@ -213,36 +748,27 @@ class ConversationDB:
             return None
 
         with self._lock:
-            cursor = self.conn.cursor()
-            session_id = f"session_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-            created_at = datetime.now().isoformat()
+            # Random ids, unlike timestamps, cannot collide within a second
+            session_id = f"session_{uuid.uuid4().hex[:16]}"
             default_name = "New Conversation"
-            cursor.execute(
-                """
-                INSERT INTO conversations (user_id, session_id, name, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                (self.user_id, session_id, default_name, created_at, created_at),
+            self.conn.execute(
+                _SQL_CREATE_CONVERSATION,
+                (self.user_id, session_id, default_name),
             )
             self.conn.commit()
-            cursor.close()
+            self._name_cache[session_id] = default_name
             return session_id
 
     def update_conversation_name(self, session_id: str, name: str):
         """Updates the name of a conversation."""
         try:
             with self._lock:
-                cursor = self.conn.cursor()
-                cursor.execute(
-                    """
-                    UPDATE conversations 
-                    SET name = ?, updated_at = ?
-                    WHERE user_id = ? AND session_id = ?
-                    """,
-                    (name, datetime.now().isoformat(), self.user_id, session_id),
+                self.conn.execute(
+                    _SQL_UPDATE_CONVERSATION_NAME,
+                    (name, self.user_id, session_id),
                 )
                 self.conn.commit()
-                cursor.close()
+            self._name_cache[session_id] = name
             return True
         except Exception as e:
             logger.error(f"Error updating conversation name: {e}")
@@ -250,80 +776,105 @@ class ConversationDB:
 
     def get_conversation_name(self, session_id: str) -> str:
         """Retrieves the name of a conversation."""
-        with self._lock:
-            cursor = self.conn.cursor()
-            cursor.execute(
-                "SELECT name FROM conversations WHERE user_id = ? AND session_id = ?",
+        name = self._name_cache.get(session_id)
+        if name is not None:
+            return name
+        with self._pool.reader() as conn:
+            result = conn.execute(
+                _SQL_GET_CONVERSATION_NAME,
                 (self.user_id, session_id),
-            )
-            result = cursor.fetchone()
-            cursor.close()
-        return result[0] if result else "Unnamed Conversation"
+            ).fetchone()
+        if not result:
+            return "Unnamed Conversation"
+        self._name_cache[session_id] = result[0]
+        return result[0]
 
     def suggest_conversation_name(self, session_id: str) -> str:
         """Suggests a name based on the first user message."""
-        with self._lock:
-            cursor = self.conn.cursor()
-            cursor.execute(
-                """
-                SELECT content 
-                FROM messages 
-                WHERE user_id = ? AND session_id = ? AND role = 'user' 
-                ORDER BY timestamp ASC LIMIT 1
-                """,
+        self._wait_for_writes()
+        with self._pool.reader() as conn:
+            first_message = conn.execute(
+                _SQL_GET_FIRST_USER_MESSAGE,
                 (self.user_id, session_id),
-            )
-            first_message = cursor.fetchone()
-            cursor.close()
+            ).fetchone()
         if first_message:
-            raw_title = first_message[0].strip()
-            starters = [
-                "what is",
-                "how to",
-                "can you",
-                "please",
-                "tell me about",
-                "explain",
-            ]
-            for starter in starters:
-                if raw_title.lower().startswith(starter):
-                    raw_title = raw_title[len(starter) :].strip()
-            title = " ".join(word.capitalize() for word in raw_title.split())
+            raw_title = _STARTER_RE.sub("", first_message[0].strip(), count=1)
+            # Collect words only until the 50 character limit is passed, so
+            # long messages are never split or capitalized in full
+            words = []
+            length = -1
+            for match in _WORD_RE.finditer(raw_title):
+                words.append(match.group())
+                length += len(words[-1]) + 1
+                if length > 50:
+                    break
+            title = " ".join(words)
             if len(title) > 50:
                 breakpoint = title[:50].rfind(" ")
                 if breakpoint == -1:
                     breakpoint = 50
                 title = title[:breakpoint].strip() + "..."
+            title = " ".join(word.capitalize() for word in title.split(" "))
             return f"💬 {title}"
         return "New Conversation"
 
     def add_message(self, session_id, role, content):
         """Adds a message with proper session handling."""
-        timestamp = datetime.now().isoformat()
+        return self.add_messages(session_id, [(role, content)])
+
+    def add_messages(self, session_id, items):
+        """Queues several (role, content) messages for the background writer.
+
+        Returns False when the conversation does not exist or the database is
+        closed; flush() reports messages the writer failed to store later.
+        """
+        if self._closed:
+            logger.error("Cannot add messages: database is closed")
+            return False
+        # The writer cannot hand errors back to this caller, so reject rows
+        # the foreign key would refuse before queueing them
         try:
-            with self._lock:
-                cursor = self.conn.cursor()
-                cursor.execute(
-                    """
-                    INSERT INTO messages (user_id, session_id, role, content, timestamp)
-                    VALUES (?, ?, ?, ?, ?)
-                    """,
-                    (self.user_id, session_id, role, content, timestamp),
-                )
-                self.conn.commit()
-                cursor.close()
+            with self._pool.reader() as conn:
+                exists = conn.execute(
+                    _SQL_GET_CONVERSATION_NAME, (self.user_id, session_id)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Error adding messages: {e}")
+            return False
+        if exists is None:
+            logger.error(f"Cannot add messages: no conversation {session_id}")
+            return False
+        now = datetime.now()
+        # Offset each timestamp so messages in one batch stay distinct and ordered
+        rows = [
+            (role, content, (now + timedelta(microseconds=i)).isoformat())
+            for i, (role, content) in enumerate(items)
+        ]
+        try:
+            with self._pending_cond:
+                # Checked under the lock close() takes, so nothing is queued
+                # behind its sentinel
+                if self._closed:
+                    logger.error("Cannot add messages: database is closed")
+                    return False
+                self._pending += len(rows)
+                for role, content, timestamp in rows:
+                    self._write_queue.put(
+                        (self.user_id, session_id, role, content, timestamp)
+                    )
 
-                # Update local storage for this session
-                chats_key = f"chats_{session_id}"
-                stored_chats = self.local_storage.load_data(chats_key) or []
-                stored_chats.append(
+            # Append the new messages to this session's local storage copy
+            self.local_storage.append_data(
+                f"chats_{session_id}",
+                [
                     {"role": role, "content": content, "timestamp": timestamp}
-                )
-                self.local_storage.save_data(chats_key, stored_chats)
+                    for role, content, timestamp in rows
+                ],
+            )
 
             return True
         except Exception as e:
-            logger.error(f"Error adding message: {e}")
+            logger.error(f"Error adding messages: {e}")
             return False
 
     def add_file(self, session_id, file_path, file_name):
@@ -336,35 +887,19 @@ class ConversationDB:
                 )
                 return False
             with self._lock:
-                cursor = self.conn.cursor()
-                cursor.execute(
-                    "SELECT COUNT(*) FROM files WHERE user_id = ? AND session_id = ? AND file_name = ?",
-                    (self.user_id, session_id, file_name),
-                )
-                result = cursor.fetchone()
-                count = result[0] if result and result[0] is not None else 0
-                if count > 0:
-                    logger.warning(
-                        f"File {file_name} already exists in session {session_id}"
-                    )
-                    cursor.close()
-                    return False
-                timestamp = datetime.now().isoformat()
-                cursor.execute(
-                    """
-                    INSERT INTO files (user_id, session_id, file_path, file_name, uploaded_at)
-                    VALUES (?, ?, ?, ?, ?)
-                    """,
-                    (self.user_id, session_id, file_path, file_name, timestamp),
+                # The UNIQUE constraints reject duplicates; an ignored row means
+                # the file is already tracked
+                cursor = self.conn.execute(
+                    _SQL_ADD_FILE,
+                    (self.user_id, session_id, file_path, file_name),
                 )
                 self.conn.commit()
-                cursor.close()
+            if cursor.rowcount == 0:
+                logger.warning(
+                    f"File {file_name} already exists in session {session_id}"
+                )
+                return False
             return True
-        except sqlite3.IntegrityError:
-            logger.warning(f"File {file_name} already exists in session {session_id}")
-            with self._lock:
-                self.conn.rollback()
-            return False
         except Exception as e:
             logger.error(f"Error adding file to database: {e}")
             with self._lock:
@@ -373,102 +908,91 @@ class ConversationDB:
 
     def get_conversations(self):
         """Retrieves all conversations."""
-        with self._lock:
-            cursor = self.conn.cursor()
-            cursor.execute(
-                """SELECT session_id, created_at 
-                FROM conversations 
-                WHERE user_id = ? 
-                ORDER BY created_at DESC""",
+        with self._pool.reader() as conn:
+            rows = conn.execute(
+                _SQL_GET_CONVERSATIONS,
                 (self.user_id,),
-            )
-            rows = cursor.fetchall()
-            cursor.close()
+            ).fetchall()
         return rows
 
     def get_conversation_details(self):
         """Retrieves all conversations with additional details."""
-        with self._lock:
-            cursor = self.conn.cursor()
-            cursor.execute(
-                """
-                SELECT 
-                    c.session_id,
-                    c.created_at,
-                    COUNT(DISTINCT m.id) as message_count,
-                    COUNT(DISTINCT f.id) as file_count,
-                    GROUP_CONCAT(DISTINCT f.file_name) as files
-                FROM conversations c
-                LEFT JOIN messages m ON c.user_id = m.user_id AND c.session_id = m.session_id
-                LEFT JOIN files f ON c.user_id = f.user_id AND c.session_id = f.session_id
-                WHERE c.user_id = ?
-                GROUP BY c.session_id
-                ORDER BY c.created_at DESC
-            """,
+        self._wait_for_writes()
+        # Every write through this instance bumps total_changes, so the cached
+        # rows stay valid until the next one
+        changes = self.conn.total_changes
+        if self._details_cache and self._details_cache[0] == changes:
+            return self._details_cache[1]
+        with self._pool.reader() as conn:
+            rows = conn.execute(
+                _SQL_GET_CONVERSATION_DETAILS,
                 (self.user_id,),
-            )
-            rows = cursor.fetchall()
-            cursor.close()
+            ).fetchall()
+        self._details_cache = (changes, rows)
         return rows
 
     def get_messages(self, session_id):
         """Retrieves all messages for a specific conversation."""
-        with self._lock:
-            cursor = self.conn.cursor()
-            cursor.execute(
-                "SELECT role, content, timestamp FROM messages WHERE user_id = ? AND session_id = ? ORDER BY timestamp",
+        self._wait_for_writes()
+        self._sync_sessions([session_id])
+        with self._pool.reader() as conn:
+            rows = conn.execute(
+                _SQL_GET_MESSAGES,
                 (self.user_id, session_id),
-            )
-            rows = cursor.fetchall()
-            cursor.close()
+            ).fetchall()
         return rows
 
+    def iter_messages(self, session_id):
+        """Yields the messages of a conversation one row at a time."""
+        self._wait_for_writes()
+        self._sync_sessions([session_id])
+        # The reader stays borrowed until the caller finishes iterating
+        with self._pool.reader() as conn:
+            yield from conn.execute(
+                _SQL_GET_MESSAGES,
+                (self.user_id, session_id),
+            )
+
     def get_conversation_files(self, session_id):
         """Gets all files associated with a conversation."""
-        with self._lock:
-            cursor = self.conn.cursor()
-            cursor.execute(
-                """
-                SELECT DISTINCT file_path, file_name 
-                FROM files 
-                WHERE user_id = ? AND session_id = ?
-                ORDER BY uploaded_at
-                """,
+        with self._pool.reader() as conn:
+            files = conn.execute(
+                _SQL_GET_CONVERSATION_FILES,
                 (self.user_id, session_id),
-            )
-            files = cursor.fetchall()
-            cursor.close()
-        # Filter out non-existent files
-        return [(fp, fn) for fp, fn in files if os.path.exists(fp)]
+            ).fetchall()
+        # Filter out non-existent files, listing each directory once
+        # instead of calling stat() per file
+        existing = {}
+        for fp, _ in files:
+            directory = os.path.dirname(fp)
+            if directory not in existing:
+                try:
+                    with os.scandir(directory or ".") as entries:
+                        existing[directory] = {entry.name for entry in entries}
+                except OSError:
+                    existing[directory] = set()
+        return [
+            (fp, fn)
+            for fp, fn in files
+            if os.path.basename(fp) in existing[os.path.dirname(fp)]
+        ]
 
     def delete_conversation(self, session_id):
         """Deletes a conversation and cleans up local storage."""
+        self._wait_for_writes()
         try:
-            # Get files to delete
-            files = self.get_conversation_files(session_id)
-            # Delete files from disk
-            for file_path, _ in files:
-                try:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                except Exception as e:
-                    logger.error(f"Error deleting file {file_path}: {e}")
-            with self._lock:
-                cursor = self.conn.cursor()
-                cursor.execute(
-                    "DELETE FROM files WHERE user_id = ? AND session_id = ?",
+            with self._lock, self.conn:
+                # Queue the conversation's files for the background cleanup worker
+                self.conn.execute(
+                    _SQL_QUEUE_CONVERSATION_FILES,
                     (self.user_id, session_id),
                 )
-                cursor.execute(
-                    "DELETE FROM messages WHERE user_id = ? AND session_id = ?",
+                self.conn.execute(
+                    _SQL_DELETE_CONVERSATION,
                     (self.user_id, session_id),
                 )
-                cursor.execute(
-                    "DELETE FROM conversations WHERE user_id = ? AND session_id = ?",
-                    (self.user_id, session_id),
-                )
-                self.conn.commit()
-                cursor.close()
+            self._cleanup_event.set()
+            self._name_cache.pop(session_id, None)
 
             # Clean up local storage
             self.local_storage.save_data(f"notes_{session_id}", [])
@@ -484,13 +1008,16 @@ class ConversationDB:
         """Deletes a specific file from the database and disk."""
         try:
             with self._lock:
-                cursor = self.conn.cursor()
-                cursor.execute(
-                    "DELETE FROM files WHERE user_id = ? AND session_id = ? AND file_path = ?",
+                # RETURNING yields the row only if it existed
+                deleted = self.conn.execute(
+                    _SQL_DELETE_FILE,
                     (self.user_id, session_id, file_path),
-                )
+                ).fetchone()
                 self.conn.commit()
-                cursor.close()
+            if deleted is None:
+                return False
+            if os.path.lexists(deleted[0]):
+                os.remove(deleted[0])
             return True
         except Exception as e:
             logger.error(f"Error deleting file: {e}")
@@ -498,6 +1025,23 @@ class ConversationDB:
                 self.conn.rollback()
             return False
 
+    def delete_message(self, session_id: str, timestamp: str) -> bool:
+        """Deletes a single message identified by its timestamp."""
+        self._wait_for_writes()
+        try:
+            with self._lock:
+                self.conn.execute(
+                    _SQL_DELETE_MESSAGE,
+                    (self.user_id, session_id, timestamp),
+                )
+                self.conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting message: {e}")
+            with self._lock:
+                self.conn.rollback()
+            return False
+
     def add_note(
         self,
         title: str,
@@ -510,53 +1054,26 @@ class ConversationDB:
         timestamp = datetime.now().isoformat()
         try:
             with self._lock:
-                # Check if note already exists
-                cursor = self.conn.cursor()
-                cursor.execute(
-                    "SELECT id FROM notes WHERE user_id = ? AND file_path = ?",
+                cursor = self.conn.execute(
+                    _SQL_ADD_NOTE,
                     (
                         self.user_id,
+                        title,
+                        content,
                         file_path,
+                        file_type,
+                        timestamp,
+                        timestamp,
+                        conversation_id,
                     ),
                 )
-                existing = cursor.fetchone()
-
-                if existing:
-                    # Update existing note
-                    cursor.execute(
-                        """
-                        UPDATE notes 
-                        SET title = ?, content = ?, updated_at = ?
-                        WHERE user_id = ? AND file_path = ?
-                        """,
-                        (title, content, timestamp, self.user_id, file_path),
-                    )
-                else:
-                    # Insert new note
-                    cursor.execute(
-                        """
-                        INSERT INTO notes (user_id, title, content, file_path, file_type, created_at, updated_at, conversation_id)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                        """,
-                        (
-                            self.user_id,
-                            title,
-                            content,
-                            file_path,
-                            file_type,
-                            timestamp,
-                            timestamp,
-                            conversation_id,
-                        ),
-                    )
-
                 self.conn.commit()
-                cursor.close()
+                if cursor.rowcount == 0:
+                    logger.error(f"Note {file_path} belongs to another user")
+                    return False
 
-                # Sync with local storage
+                # Sync with local storage, replacing any note at this path
                 notes_key = f"notes_{conversation_id}" if conversation_id else "notes"
-                stored_notes = self.local_storage.load_data(notes_key) or []
-
                 new_note = {
                     "title": title,
                     "content": content,
@@ -567,18 +1084,7 @@ class ConversationDB:
                     "conversation_id": conversation_id,
                 }
 
-                # Update or add the note in stored notes
-                note_found = False
-                for i, note in enumerate(stored_notes):
-                    if note.get("file_path") == file_path:
-                        stored_notes[i] = new_note
-                        note_found = True
-                        break
-
-                if not note_found:
-                    stored_notes.append(new_note)
-
-                self.local_storage.save_data(notes_key, stored_notes)
+                self.local_storage.put_item(notes_key, "file_path", new_note)
                 return True
 
         except Exception as e:
@@ -587,35 +1093,26 @@ class ConversationDB:
 
     def get_notes(self):
         """Get all notes."""
-        with self._lock:
-            cursor = self.conn.cursor()
-            cursor.execute(
-                """
-                SELECT title, content, file_path, file_type, created_at, conversation_id
-                FROM notes
-                WHERE user_id = ?
-                ORDER BY created_at DESC
-            """,
+        self._sync_sessions(self._session_ids)
+        with self._pool.reader() as conn:
+            notes = conn.execute(
+                _SQL_GET_NOTES,
                 (self.user_id,),
-            )
-            notes = cursor.fetchall()
-            cursor.close()
+            ).fetchall()
         return notes
 
     def delete_note(self, file_path: str) -> bool:
         """Delete a note from the database."""
         try:
             with self._lock:
-                cursor = self.conn.cursor()
-                cursor.execute(
-                    "DELETE FROM notes WHERE user_id = ? AND file_path = ?",
+                self.conn.execute(
+                    _SQL_DELETE_NOTE,
                     (
                         self.user_id,
                         file_path,
                     ),
                 )
                 self.conn.commit()
-                cursor.close()
             return True
         except Exception as e:
             logger.error(f"Error deleting note from database: {e}")
@@ -628,20 +1125,12 @@ class ConversationDB:
         timestamp = datetime.now().isoformat()
         try:
             with self._lock:
-                # First get the full note details
-                cursor = self.conn.cursor()
-                cursor.execute(
-                    """
-                    SELECT content, file_type, conversation_id, created_at
-                    FROM notes 
-                    WHERE user_id = ? AND file_path = ?
-                    """,
-                    (
-                        self.user_id,
-                        file_path,
-                    ),
-                )
-                result = cursor.fetchone()
+                # Update the note, getting back the details local storage needs
+                result = self.conn.execute(
+                    _SQL_UPDATE_NOTE_TITLE,
+                    (new_title, timestamp, self.user_id, file_path),
+                ).fetchone()
+                self.conn.commit()
 
                 if not result:
                     logger.error(f"Note not found: {file_path}")
@@ -649,41 +1138,22 @@ class ConversationDB:
 
                 content, file_type, conversation_id, created_at = result
 
-                # Update the note in database
-                cursor.execute(
-                    """
-                    UPDATE notes 
-                    SET title = ?, updated_at = ?
-                    WHERE user_id = ? AND file_path = ?
-                    """,
-                    (new_title, timestamp, self.user_id, file_path),
-                )
-                self.conn.commit()
-
                 # Update in local storage
                 notes_key = f"notes_{conversation_id}" if conversation_id else "notes"
-                stored_notes = self.local_storage.load_data(notes_key) or []
-
-                # Find and update the note in stored notes
-                for note in stored_notes:
-                    if note.get("file_path") == file_path:
-                        note.update(
-                            {
-                                "title": new_title,
-                                "updated_at": timestamp,
-                                # Preserve other fields
-                                "content": content,
-                                "file_type": file_type,
-                                "created_at": created_at,
-                                "conversation_id": conversation_id,
-                                "file_path": file_path,
-                            }
-                        )
-                        break
-
-                # Save updated notes back to local storage
-                self.local_storage.save_data(notes_key, stored_notes)
-                cursor.close()
+                self.local_storage.put_item(
+                    notes_key,
+                    "file_path",
+                    {
+                        "title": new_title,
+                        "updated_at": timestamp,
+                        # Preserve other fields
+                        "content": content,
+                        "file_type": file_type,
+                        "created_at": created_at,
+                        "conversation_id": conversation_id,
+                        "file_path": file_path,
+                    },
+                )
                 return True
 
         except Exception as e:
@@ -694,5 +1164,16 @@ class ConversationDB:
 
     def close(self):
         """Closes the database connection."""
-        with self._lock:
-            self.conn.close()
+        with self._pending_cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._write_queue.put(None)
+        with _instances_lock:
+            if _instances.get((self.user_id, self.db_path)) is self:
+                del _instances[(self.user_id, self.db_path)]
+        self._writer_thread.join(timeout=5)
+        self._cleanup_stop.set()
+        self._cleanup_event.set()
+        self._cleanup_thread.join(timeout=5)
+        self._pool.close()
@@ -1,11 +1,20 @@
+import collections
+import dataclasses
+import functools
+import hashlib
+import json
 import os
+import re
+import shutil
 import time
 import logging
+import mmap
+import multiprocessing
 import pickle
 import threading
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Literal, Optional
 import concurrent.futures
 
 import numpy as np
@@ -17,9 +26,12 @@ from llama_index.core import (
     Settings,
 )
 from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.ingestion import IngestionPipeline
 from llama_index.core.node_parser import SentenceSplitter
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.readers.json import JSONReader
+from llama_index.core.postprocessor import SimilarityPostprocessor
+from llama_index.core.schema import MetadataMode, QueryBundle
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.vector_stores.simple import SimpleVectorStoreData
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -30,14 +42,42 @@ logger = logging.getLogger(__name__)
 # ========================
 
 
+def _hasher(size: int):
+    """Return the fastest available function digesting bytes to size bytes"""
+    try:
+        import xxhash
+    except ImportError:
+        # SHAKE-256 is an extendable-output hash, so any size comes in one call
+        return lambda data: hashlib.shake_256(data).digest(size)
+
+    def digest(data: bytes) -> bytes:
+        # A non-cryptographic 128-bit hash stretched to size bytes by
+        # domain-separated rounds over the first digest
+        head = xxhash.xxh3_128_digest(data)
+        return head + b"".join(
+            xxhash.xxh3_128_digest(head + bytes([i])) for i in range(1, size // 16)
+        )
+
+    return digest
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length in place, so inner product is cosine"""
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+    return matrix
+
+
 class BasicEmbedding(BaseEmbedding):
     """Fallback embedding using text hashing"""
 
-    def __init__(self):
-        super().__init__()
-        self._model_name = "basic-hash-embedding"
+    def __init__(self, quantization: Literal["fp32", "int8", "binary"] = "binary"):
+        if quantization not in ("fp32", "int8", "binary"):
+            raise ValueError(f"Unknown quantization: {quantization}")
+        # A field rather than a property, so pickling the index leaves it be
+        super().__init__(model_name="basic-hash-embedding")
         self._model_dim = 384
         self._normalize = True
+        self._quantization = quantization
 
     def _get_query_embedding(self, query: str) -> List[float]:
         return self._hash_text(query)
@@ -52,24 +92,29 @@ class BasicEmbedding(BaseEmbedding):
         return self._hash_text(text)
 
     def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
-        return [self._hash_text(text) for text in texts]
+        return self._hash_texts(texts).tolist()
 
     async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
-        return [self._hash_text(text) for text in texts]
+        return self._hash_texts(texts).tolist()
 
     def _hash_text(self, text: str) -> List[float]:
         """Create hash-based embedding vector"""
-        import hashlib
-
-        hash_obj = hashlib.sha384(text.encode())
-        hash_bytes = hash_obj.digest()
-        embedding = np.frombuffer(hash_bytes, dtype=np.uint8)
-        embedding = embedding.astype(np.float32) / 255.0
-        return embedding.tolist()
-
-    @property
-    def model_name(self) -> str:
-        return self._model_name
+        return self._hash_texts([text])[0].tolist()
+
+    def _hash_texts(self, texts: List[str]) -> np.ndarray:
+        """Hash a batch of texts into one model_dim wide matrix"""
+        digest = _hasher(self._model_dim)
+        digests = np.frombuffer(
+            b"".join(digest(text.encode()) for text in texts), dtype=np.uint8
+        ).reshape(len(texts), self._model_dim)
+        embeddings = digests.astype(np.float32)
+        embeddings *= 1.0 / 255.0
+        # Hash bytes carry no finer structure, so coarse levels lose nothing
+        if self._quantization == "binary":
+            embeddings = np.where(embeddings >= 0.5, 1.0, -1.0).astype(np.float32)
+        elif self._quantization == "int8":
+            embeddings = np.round((embeddings - 0.5) * 127)
+        return _normalize_rows(embeddings) if self._normalize else embeddings
 
     @property
     def model_dim(self) -> int:
@@ -80,17 +125,68 @@ class BasicEmbedding(BaseEmbedding):
         return self._normalize
 
 
+class _ModelTokenizer:
+    """Counts tokens for the splitter with the embedding model's Rust tokenizer"""
+
+    def __init__(self, tokenizer):
+        self._tokenizer = tokenizer
+
+    def __call__(self, text: str) -> List[int]:
+        return self._tokenizer.encode(text, add_special_tokens=False).ids
+
+
+# ==============
+# VECTOR STORAGE
+# ==============
+
+
+class Float16VectorStore(SimpleVectorStore):
+    """In-memory vector store persisted as a float16 matrix instead of JSON floats"""
+
+    def persist(self, persist_path: str, fs=None) -> None:
+        # to_dict() would convert every vector element by element
+        embedding_dict = self.data.embedding_dict
+        data = dataclasses.replace(self.data, embedding_dict={}).to_dict()
+        del data["embedding_dict"]
+        data["embedding_ids"] = list(embedding_dict)
+        matrix = np.asarray(list(embedding_dict.values()), dtype=np.float16)
+        Path(persist_path).parent.mkdir(parents=True, exist_ok=True)
+        np.save(Path(persist_path).with_suffix(".npy"), matrix)
+        try:
+            import orjson
+
+            Path(persist_path).write_bytes(orjson.dumps(data))
+        except ImportError:
+            with open(persist_path, "w") as f:
+                json.dump(data, f)
+
+    @classmethod
+    def from_persist_path(cls, persist_path: str, fs=None) -> "Float16VectorStore":
+        try:
+            import orjson
+
+            data = orjson.loads(Path(persist_path).read_bytes())
+        except ImportError:
+            with open(persist_path) as f:
+                data = json.load(f)
+        matrix = np.load(Path(persist_path).with_suffix(".npy"))
+        embedding_ids = data.pop("embedding_ids")
+        data["embedding_dict"] = {}
+        store_data = SimpleVectorStoreData.from_dict(data)
+        # Rows of one float32 matrix, instead of a boxed float per element
+        store_data.embedding_dict = dict(zip(embedding_ids, matrix.astype(np.float32)))
+        return cls(data=store_data)
+
+
 # =================
 # CORE FUNCTIONALITY
 # =================
 
 
-def get_file_metadata(path: str) -> Dict[str, Any]:
-    """Generate metadata for files"""
-    stats = os.stat(path)
-    ext = os.path.splitext(path)[1][1:].lower()
-
-    file_type_categories = {
+# File extension to metadata category, flattened once for lookups
+_EXT_TO_CATEGORY = {
+    ext: category
+    for category, exts in {
         "text": ["txt", "md"],
         "document": ["pdf", "docx"],
         "presentation": ["ppt", "pptm", "pptx"],
@@ -100,24 +196,209 @@ def get_file_metadata(path: str) -> Dict[str, Any]:
         "notebook": ["ipynb"],
         "korean_doc": ["hwp"],
         "data": ["json"],
-    }
+    }.items()
+    for ext in exts
+}
+_TEXT_EXTS = frozenset(("txt", "md", "csv", "json"))
 
-    file_category = next(
-        (cat for cat, exts in file_type_categories.items() if ext in exts), "other"
-    )
+
+def get_file_metadata(path: str, stats: os.stat_result = None) -> Dict[str, Any]:
+    """Generate metadata for files, reusing ``stats`` when already known"""
+    if stats is None:
+        stats = os.stat(path)
+    ext = os.path.splitext(path)[1][1:].lower()
 
     return {
         "file_name": os.path.basename(path),
         "file_type": ext,
-        "file_category": file_category,
+        "file_category": _EXT_TO_CATEGORY.get(ext, "other"),
         "file_size": stats.st_size,
         "file_size_formatted": f"{stats.st_size / 1024:.1f} KB",
         "created_at": datetime.fromtimestamp(stats.st_ctime).isoformat(),
         "modified_at": datetime.fromtimestamp(stats.st_mtime).isoformat(),
-        "is_binary": ext not in ["txt", "md", "csv", "json"],
+        "is_binary": ext not in _TEXT_EXTS,
     }
 
 
+# Below this many uploads, starting worker processes costs more than parsing
+_MIN_PROCESS_FILES = 4
+# Upper bound on the processes splitting documents into nodes, and the text
+# each must have to split before starting one beats splitting in process
+_MAX_SPLIT_WORKERS = 8
+_SPLIT_CHARS_PER_WORKER = 2_000_000
+# Sessions with this many nodes store them in a FAISS IVF-PQ index, which
+# needs enough vectors to train its centroids and 256-entry code books
+_FAISS_MIN_NODES = 2048
+_FAISS_PQ_SUBVECTORS = 48
+# Smallest batch left after halving it on CUDA out-of-memory errors
+_MIN_EMBED_BATCH = 4
+# File the storage context persists the default vector store to
+_VECTOR_STORE_FILE = "default__vector_store.json"
+# A session directory changed this recently may change again within the
+# same timestamp tick, so its scan is not reused
+_SCAN_SETTLE_NS = 1_000_000_000
+# Retrieved nodes scoring below this cosine similarity are dropped
+_SIMILARITY_CUTOFF = 0.7
+# Queries differing only in case and spacing share a cached result
+_WHITESPACE_RE = re.compile(r"\s+")
+_QUERY_CACHE_SIZE = 1024
+
+
+def _read_file(path: str, stats: os.stat_result = None) -> List[Any]:
+    """Load one upload as documents; module-level so worker processes can run it"""
+    try:
+        from llama_index.readers.json import JSONReader
+
+        reader = SimpleDirectoryReader(
+            input_files=[path],
+            file_extractor={".json": JSONReader(levels_back=2, collapse_length=500)},
+            file_metadata=functools.partial(get_file_metadata, stats=stats),
+            filename_as_id=True,
+            exclude_hidden=True,
+        )
+        docs = reader.load_data()
+        if docs:
+            logger.info(f"Successfully processed {os.path.basename(path)}")
+        return docs
+    except Exception as e:
+        logger.error(f"Error processing file {path}: {e}")
+        return []
+
+
+def _env_int(name: str, default: Optional[int]) -> Optional[int]:
+    """Positive integer set in environment variable name, else default"""
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        logger.warning(f"Ignoring {name}={value!r}, which is not a positive integer")
+        return default
+    return number
+
+
+def _process_context():
+    """Start worker processes without forking this threaded process"""
+    # A fork copies locks held by other threads (torch, tokenizers, Streamlit)
+    # in whatever state they are, which can deadlock the child
+    method = (
+        "forkserver"
+        if "forkserver" in multiprocessing.get_all_start_methods()
+        else "spawn"
+    )
+    return multiprocessing.get_context(method)
+
+
+def _content_key(text: str) -> bytes:
+    """Key identifying documents with identical text"""
+    data = text.encode("utf-8", "ignore")
+    try:
+        import xxhash
+
+        return xxhash.xxh3_128_digest(data)
+    except ImportError:
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _file_digest(path: str) -> str:
+    """Hash a file's bytes through a read-only mapping instead of reads"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""  # Empty files cannot be mapped
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            try:
+                import xxhash
+
+                return xxhash.xxh3_64_hexdigest(data)
+            except ImportError:
+                return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+# Start of an LZ4 frame, telling compressed cache pickles from plain ones
+_LZ4_MAGIC = b"\x04\x22\x4d\x18"
+# Buffer for cache pickles, which are written and read in many small pieces
+_CACHE_BUFFER_SIZE = 1 << 20
+
+
+def _cache_writer(path: Path):
+    """Open a cache pickle for writing, LZ4-framed when lz4 is installed"""
+    try:
+        import lz4.frame
+
+        return lz4.frame.open(path, "wb", compression_level=0)
+    except ImportError:
+        return open(path, "wb", buffering=_CACHE_BUFFER_SIZE)
+
+
+def _cache_reader(path: Path):
+    """Open a cache pickle for reading, whether or not it was compressed"""
+    with open(path, "rb") as f:
+        compressed = f.read(len(_LZ4_MAGIC)) == _LZ4_MAGIC
+    if compressed:
+        import lz4.frame
+
+        return lz4.frame.open(path, "rb")
+    return open(path, "rb", buffering=_CACHE_BUFFER_SIZE)
+
+
+def _add_duplicate_source(kept, duplicate):
+    """Record on a kept document the file of a duplicate dropped in its favour"""
+    kept.metadata.setdefault("also_in", []).append(duplicate.metadata.get("file_name"))
+    # Attribution only; keep it out of the embedded and prompted text
+    for excluded in (
+        kept.excluded_embed_metadata_keys,
+        kept.excluded_llm_metadata_keys,
+    ):
+        if "also_in" not in excluded:
+            excluded.append("also_in")
+
+
+# Held around every call into an embedding model. Each is shared by all
+# sessions, and its fast tokenizer raises "Already borrowed" when two
+# threads encode with it at once
+_embed_model_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def _load_embed_model(model_name: str, cache_folder: str) -> BaseEmbedding:
+    """Load an embedding model once, shared by every session's IndexManager"""
+    # Parsed before the model loads, so a bad value falls back to the default
+    # batch size rather than to hashed embeddings
+    embed_batch = _env_int("DOCUVERSE_EMBED_BATCH", None)
+    try:
+        # torch and transformers load here, when the first session
+        # needs a model, rather than when the module is imported
+        import torch
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+        # On a GPU, embed in FP16 with batches large enough to fill it.
+        # DOCUVERSE_EMBED_BATCH overrides the batch size
+        cuda = torch.cuda.is_available()
+        device_kwargs = (
+            {"device": "cuda", "model_kwargs": {"torch_dtype": torch.float16}}
+            if cuda
+            else {"device": "cpu"}
+        )
+        device_kwargs["embed_batch_size"] = embed_batch or (256 if cuda else 128)
+        # Initialize embedding model directly without SentenceTransformer
+        embed_model = HuggingFaceEmbedding(
+            model_name=model_name,
+            cache_folder=cache_folder,
+            **device_kwargs,
+        )
+        logger.info(f"Initialized embedding model: {model_name}")
+        return embed_model
+    except Exception as e:
+        logger.error(f"Embedding error: {e}")
+        logger.warning("Using basic fallback embedding")
+        return BasicEmbedding()
+
+
 class IndexManager:
     """Main index management class"""
 
@@ -144,6 +425,10 @@ class IndexManager:
         self.cache_dir = (
             f"./cache/{user_id}/{session_id}" if session_id else f"./cache/{user_id}"
         )
+        self.fingerprint_file = Path(self.storage_dir) / ".fingerprint"
+        # Fingerprint of the index this manager built, known before the
+        # writer thread has persisted it
+        self._index_fingerprint = None
         self.data_dir = data_dir
         self.models_cache = os.path.join(os.path.dirname(__file__), "models")
         self.session_dir = (
@@ -156,7 +441,6 @@ class IndexManager:
         self.processed_files = set()
         self.index = None
         self.last_index_time = 0
-        self.index_rebuild_interval = 300  # 5 minutes
 
         # Initialize directories
         for path in [
@@ -179,81 +463,315 @@ class IndexManager:
 
         self._index_build_lock = threading.Lock()
         self._index_build_thread = None
-        self._processing_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        self._persist_thread = None
+        # Runs queries; DOCUVERSE_MAX_WORKERS sizes it, by default leaving a
+        # core to the app
+        self._processing_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=_env_int(
+                "DOCUVERSE_MAX_WORKERS", max(1, (os.cpu_count() or 2) - 1)
+            )
+        )
+        # Parses batches too small for worker processes, apart from the query
+        # pool so a parse never holds up a query
+        self._parse_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=_MIN_PROCESS_FILES - 1
+        )
+        self._stat_cache: Dict[str, os.stat_result] = {}
+        # (directory mtime, stats) of the last scan of a settled directory
+        self._scan_cache = None
+        # Retrieved nodes per (normalized query, top_k) and retrievers per
+        # top_k, both dropped by _index_changed
+        self._query_cache: "collections.OrderedDict[tuple, list]" = (
+            collections.OrderedDict()
+        )
+        self._query_cache_lock = threading.Lock()
+        self._retrievers = {}
+        self._similarity_filter = SimilarityPostprocessor(
+            similarity_cutoff=_SIMILARITY_CUTOFF
+        )
 
     def _initialize_embedding_model(self):
-        """Initialize embedding model with correct parameters"""
-        try:
-            # Initialize embedding model directly without SentenceTransformer
-            self.embed_model = HuggingFaceEmbedding(
-                model_name=self.model_name,
-                cache_folder=self.models_cache,
-                embed_batch_size=64,  # Increased batch size for faster processing
-            )
-            Settings.embed_model = self.embed_model
-            logger.info(f"Initialized embedding model: {self.model_name}")
-        except Exception as e:
-            logger.error(f"Embedding error: {e}")
-            logger.warning("Using basic fallback embedding")
-            self.embed_model = BasicEmbedding()
-            Settings.embed_model = self.embed_model
+        """Use the process-wide embedding model, loading it for the first session"""
+        self.embed_model = _load_embed_model(self.model_name, self.models_cache)
 
     def _load_caches(self):
         """Load cached data"""
         self.embedding_cache_file = Path(self.cache_dir) / "embeddings.pkl"
         self.index_cache_file = Path(self.cache_dir) / "index.pkl"
+        self.chunk_vectors_file = Path(self.cache_dir) / "chunk_vectors.npy"
 
         try:
             if self.embedding_cache_file.exists():
-                with open(self.embedding_cache_file, "rb") as f:
+                with _cache_reader(self.embedding_cache_file) as f:
                     self._embedding_cache = pickle.load(f)
             else:
                 self._embedding_cache = {}
 
+            # Keys pickled apart from their matrix by earlier versions
+            self._embedding_cache.pop("chunk_vector_keys", None)
+            if self.chunk_vectors_file.exists():
+                # Rows are views of the mapped file, read only when reused
+                rows = np.load(self.chunk_vectors_file, mmap_mode="r")
+                if rows.dtype.names == ("key", "vector"):
+                    self._embedding_cache["chunk_vectors"] = dict(
+                        zip(map(bytes, rows["key"]), rows["vector"])
+                    )
+
             if self.index_cache_file.exists():
-                with open(self.index_cache_file, "rb") as f:
+                with _cache_reader(self.index_cache_file) as f:
                     cache_data = pickle.load(f)
                     self.index = cache_data.get("index")
                     self.last_index_time = cache_data.get("timestamp", 0)
         except Exception as e:
+            # Unreadable, e.g. written by another version; start over
             logger.error(f"Cache load error: {e}")
             self._embedding_cache = {}
+            for path in (
+                self.embedding_cache_file,
+                self.index_cache_file,
+                self.chunk_vectors_file,
+            ):
+                path.unlink(missing_ok=True)
 
     def _save_caches(self):
         """Persist cached data"""
         try:
-            with open(self.embedding_cache_file, "wb") as f:
-                pickle.dump(self._embedding_cache, f)
-
-            if self.index:
+            # Chunk vectors go to one float16 matrix file, the precision the
+            # vector store persists anyway, with each row's key beside it so
+            # the file never disagrees with a pickle about which row is which
+            cache = dict(self._embedding_cache)
+            vectors = cache.pop("chunk_vectors", None)
+            if vectors:
+                dim = len(next(iter(vectors.values())))
+                rows = np.empty(
+                    len(vectors),
+                    dtype=[("key", np.uint8, (16,)), ("vector", np.float16, (dim,))],
+                )
+                rows["key"] = np.frombuffer(b"".join(vectors), dtype=np.uint8).reshape(
+                    -1, 16
+                )
+                rows["vector"] = np.asarray(list(vectors.values()), dtype=np.float16)
+                # Write beside and rename, as loaded rows may map the old file
+                tmp_file = self.chunk_vectors_file.with_suffix(".tmp.npy")
+                np.save(tmp_file, rows)
+                os.replace(tmp_file, self.chunk_vectors_file)
+            else:
+                self.chunk_vectors_file.unlink(missing_ok=True)
+            with _cache_writer(self.embedding_cache_file) as f:
+                pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+            if self._embedding_cache.get("vector_store") == "faiss":
+                # FAISS indexes cannot be pickled; they persist with the storage
+                self.index_cache_file.unlink(missing_ok=True)
+            elif self.index:
                 cache_data = {"index": self.index, "timestamp": time.time()}
-                with open(self.index_cache_file, "wb") as f:
-                    pickle.dump(cache_data, f)
+                with _cache_writer(self.index_cache_file) as f:
+                    pickle.dump(cache_data, f, protocol=pickle.HIGHEST_PROTOCOL)
         except Exception as e:
             logger.error(f"Cache save error: {e}")
 
+    def _persist(self, storage_context, fingerprint: str):
+        """Write the index and its fingerprint beside the live one, then swap"""
+        new_dir, old_dir = f"{self.storage_dir}.new", f"{self.storage_dir}.old"
+        try:
+            # Leftovers of a write that was cut short
+            shutil.rmtree(new_dir, ignore_errors=True)
+            shutil.rmtree(old_dir, ignore_errors=True)
+            storage_context.persist(persist_dir=new_dir)
+            (Path(new_dir) / self.fingerprint_file.name).write_text(fingerprint)
+            # Readers find the old files or the new ones (or, between the
+            # renames, none), never a mix; a mapped FAISS index keeps its
+            # unlinked file until it is closed
+            if os.path.exists(self.storage_dir):
+                os.replace(self.storage_dir, old_dir)
+            os.replace(new_dir, self.storage_dir)
+            shutil.rmtree(old_dir, ignore_errors=True)
+            self._save_caches()
+        except Exception as e:
+            logger.error(f"Index persist error: {e}")
+
+    def _persist_async(self, storage_context, fingerprint: str):
+        """Persist on a writer thread so the new index serves queries meanwhile"""
+        # Not a daemon, so interpreter exit waits for the write to finish
+        self._persist_thread = threading.Thread(
+            target=self._persist, args=(storage_context, fingerprint)
+        )
+        self._persist_thread.start()
+
+    def _wait_for_persist(self):
+        """Wait for the last index write, before changing caches or exiting"""
+        if self._persist_thread and self._persist_thread.is_alive():
+            self._persist_thread.join()
+
+    def close(self):
+        """Wait for the last index write and stop the worker threads"""
+        self._wait_for_persist()
+        self._parse_pool.shutdown()
+        self._processing_pool.shutdown()
+
     def _should_rebuild(self) -> bool:
         """Determine if index needs rebuilding"""
         if not self.index:
             return True
 
-        if time.time() - self.last_index_time > self.index_rebuild_interval:
-            return True
+        return not self._index_is_current()
+
+    def _content_hashes(self, stats: Dict[str, os.stat_result]) -> Dict[str, str]:
+        """Hash each upload's bytes, re-reading only those whose size or mtime moved"""
+        known = self._embedding_cache.get("content_hashes", {})
+        entries = {}
+        for path, file_stats in stats.items():
+            signature = (file_stats.st_size, file_stats.st_mtime_ns)
+            cached = known.get(path)
+            entries[path] = (
+                cached
+                if cached and cached[:2] == signature
+                else (*signature, _file_digest(path))
+            )
+        if entries != known:
+            # Replaced rather than updated, as the writer may be pickling it
+            self._embedding_cache["content_hashes"] = entries
+        return {path: entry[2] for path, entry in entries.items()}
 
-        # Use os.scandir for more efficient file iteration
-        current_files = {
-            entry.name: f"{entry.stat().st_size}_{entry.stat().st_mtime}"
-            for entry in os.scandir(self.data_dir)
-            if entry.is_file()
-        }
-        cached_files = self._embedding_cache.get("file_hashes", {})
-        return current_files != cached_files
-
-    def _get_file_hash(self, filename: str) -> str:
-        """Generate quick file hash"""
-        path = os.path.join(self.data_dir, filename)
-        stats = os.stat(path)
-        return f"{stats.st_size}_{stats.st_mtime}"
+    def _fingerprint(self, stats: Dict[str, os.stat_result]) -> str:
+        """Hash the session's uploads by name and content"""
+        try:
+            import xxhash
+
+            digest = xxhash.xxh3_64()
+        except ImportError:
+            digest = hashlib.blake2b(digest_size=8)
+        for path, content_hash in sorted(self._content_hashes(stats).items()):
+            digest.update(f"{os.path.basename(path)}\0{content_hash}\n".encode())
+        return digest.hexdigest()
+
+    def _index_is_current(self) -> bool:
+        """Whether the index was built from the uploads now on disk"""
+        try:
+            stored = self._index_fingerprint or self.fingerprint_file.read_text()
+            return stored == self._fingerprint(self._scan_session_files())
+        except OSError:
+            # No fingerprint yet, or an upload vanished while being hashed
+            return False
+
+    def _splitter_tokenizer(self):
+        """A copy of the embed model's fast tokenizer, so chunks are sized in its tokens"""
+        try:
+            backend = self.embed_model._model.tokenizer.backend_tokenizer
+        except AttributeError:
+            # BasicEmbedding has no tokenizer; the splitter uses its default
+            return None
+        from tokenizers import Tokenizer
+
+        # The model's own tokenizer truncates to its 512-token input, which
+        # would cap the counts, and other threads encode with it meanwhile
+        with _embed_model_lock:
+            tokenizer = Tokenizer.from_str(backend.to_str())
+        tokenizer.no_truncation()
+        tokenizer.no_padding()
+        return _ModelTokenizer(tokenizer)
+
+    def _embed_nodes(self, nodes):
+        """Embed nodes in model-sized batches; the index skips embedded nodes"""
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        if isinstance(self.embed_model, BasicEmbedding):
+            # Hashing is cheap, so skip the batches and hash every text at once
+            for node, row in zip(nodes, self.embed_model._hash_texts(texts).tolist()):
+                node.embedding = row
+            return
+
+        # Chunks whose text was embedded by the previous build reuse its vector
+        cache = self._embedding_cache.get("chunk_vectors", {})
+        if self._embedding_cache.get("chunk_vectors_model") != self.model_name:
+            cache = {}
+        keys = [_content_key(text) for text in texts]
+        missing = list({k: i for i, k in enumerate(keys) if k not in cache}.values())
+
+        import torch
+
+        # Batches run one after another: the model only runs one at a time
+        # anyway, on one device. Out-of-memory errors halve the batch for the
+        # rest of this build only, as the model's embed_batch_size is shared
+        batch_size = self.embed_model.embed_batch_size
+        done = 0
+        while done < len(missing):
+            batch = missing[done : done + batch_size]
+            try:
+                with _embed_model_lock:
+                    embeddings = self.embed_model.get_text_embedding_batch(
+                        [texts[i] for i in batch]
+                    )
+            except torch.cuda.OutOfMemoryError:
+                torch.cuda.empty_cache()
+                if batch_size <= _MIN_EMBED_BATCH:
+                    raise
+                batch_size = max(_MIN_EMBED_BATCH, batch_size // 2)
+                logger.warning(
+                    f"Out of GPU memory, embedding in batches of {batch_size}"
+                )
+                continue
+            # Unit rows keep FAISS inner products and the cutoff on the
+            # cosine scale, whatever the model wrapper returned
+            vectors = _normalize_rows(np.asarray(embeddings, dtype=np.float32))
+            for i, vector in zip(batch, vectors):
+                cache[keys[i]] = vector
+            done += len(batch)
+
+        # BaseNode.embedding is a list of floats; llama_index tests it for
+        # truth and pydantic serializes it, neither of which takes an array
+        for node, key in zip(nodes, keys):
+            node.embedding = cache[key].tolist()
+        logger.info(f"Embedded {len(missing)} of {len(nodes)} chunks")
+        # Keep only this build's chunks so removed uploads do not linger
+        self._embedding_cache["chunk_vectors"] = {key: cache[key] for key in keys}
+        self._embedding_cache["chunk_vectors_model"] = self.model_name
+
+    def _faiss_storage_context(self, nodes):
+        """Train an IVF-PQ index on embedded nodes, if FAISS is installed"""
+        if len(nodes) < _FAISS_MIN_NODES:
+            return None
+        try:
+            import faiss
+            from llama_index.vector_stores.faiss import FaissVectorStore
+        except ImportError:
+            return None
+
+        vectors = np.asarray([node.embedding for node in nodes], dtype=np.float32)
+        dim = vectors.shape[1]
+        if dim % _FAISS_PQ_SUBVECTORS:
+            return None
+
+        quantizer = faiss.IndexFlatIP(dim)
+        faiss_index = faiss.IndexIVFPQ(
+            quantizer,
+            dim,
+            int(len(nodes) ** 0.5),
+            _FAISS_PQ_SUBVECTORS,
+            8,
+            faiss.METRIC_INNER_PRODUCT,
+        )
+        faiss_index.train(vectors)
+        return StorageContext.from_defaults(
+            vector_store=FaissVectorStore(faiss_index=faiss_index)
+        )
+
+    def _scan_session_files(self) -> Dict[str, os.stat_result]:
+        """Stat every upload once, rescanning only after the directory changed"""
+        # Uploads are renamed into place and deleted, both of which move the
+        # directory's mtime, so an unchanged mtime means unchanged uploads
+        dir_mtime = os.stat(self.session_dir).st_mtime_ns
+        if self._scan_cache and self._scan_cache[0] == dir_mtime:
+            return self._scan_cache[1]
+        scanned_at = time.time_ns()
+        with os.scandir(self.session_dir) as entries:
+            stats = {
+                os.path.normpath(entry.path): entry.stat()
+                for entry in entries
+                if entry.is_file()
+            }
+        if scanned_at - dir_mtime > _SCAN_SETTLE_NS:
+            self._scan_cache = (dir_mtime, stats)
+        return stats
 
     def build_index(self, force=False):
         """Build or rebuild vector index with improved concurrency."""
@@ -282,9 +800,9 @@ class IndexManager:
                         return False  # Add return value
 
                     # Get files for this session from database
-                    from .database import ConversationDB
+                    from .database import get_db
 
-                    db = ConversationDB(user_id=self.user_id)
+                    db = get_db(self.user_id)
 
                     files = db.get_conversation_files(self.session_id)
 
@@ -298,35 +816,93 @@ class IndexManager:
                         f"Processing {len(files)} files for session {self.session_id}"
                     )
                     documents = []
-
-                    def process_file(file_info):
-                        file_path, file_name = file_info
-                        try:
-                            if not os.path.exists(file_path):
-                                logger.error(f"File not found: {file_path}")
-                                return []
-                            reader = SimpleDirectoryReader(
-                                input_files=[file_path],
-                                file_metadata=get_file_metadata,
-                                filename_as_id=True,
-                                exclude_hidden=True,
+                    self._stat_cache = self._scan_session_files()
+                    # The previous build may still be pickling the caches
+                    self._wait_for_persist()
+
+                    # Uploads unchanged since they were last parsed reuse
+                    # their documents; only the rest are read again
+                    parsed = self._embedding_cache.get("file_documents", {})
+                    file_documents = {}
+                    paths, stale_paths, stale_stats = [], [], []
+                    for file_path, _ in files:
+                        file_stats = self._stat_cache.get(os.path.normpath(file_path))
+                        if file_stats is None:
+                            logger.error(f"File not found: {file_path}")
+                            continue
+                        paths.append(file_path)
+                        signature = (file_stats.st_size, file_stats.st_mtime_ns)
+                        cached = parsed.get(file_path)
+                        if cached and cached[0] == signature:
+                            file_documents[file_path] = cached
+                        else:
+                            stale_paths.append(file_path)
+                            stale_stats.append(file_stats)
+
+                    # Parsing is CPU bound, so larger batches run in worker processes
+                    if len(stale_paths) >= _MIN_PROCESS_FILES:
+                        # DOCUVERSE_LOAD_WORKERS caps the processes, e.g. to
+                        # leave cores free for the app
+                        workers = _env_int(
+                            "DOCUVERSE_LOAD_WORKERS", os.cpu_count() or 1
+                        )
+                        executor = concurrent.futures.ProcessPoolExecutor(
+                            max_workers=max(1, min(len(stale_paths), workers)),
+                            mp_context=_process_context(),
+                        )
+                        with executor:
+                            parsed_docs = list(
+                                executor.map(_read_file, stale_paths, stale_stats)
                             )
-                            docs = reader.load_data()
-                            if docs:
-                                logger.info(f"Successfully processed {file_name}")
-                                return docs
-                        except Exception as e:
-                            logger.error(f"Error processing file {file_path}: {e}")
-                        return []
-
-                    with concurrent.futures.ThreadPoolExecutor(
-                        max_workers=4
-                    ) as executor:
-                        results = list(executor.map(process_file, files))
+                    else:
+                        parsed_docs = self._parse_pool.map(
+                            _read_file, stale_paths, stale_stats
+                        )
+                    loaded = {}
+                    for path, file_stats, docs in zip(
+                        stale_paths, stale_stats, parsed_docs
+                    ):
+                        loaded[path] = docs
+                        # Failed parses are retried by the next build
+                        if docs:
+                            signature = (file_stats.st_size, file_stats.st_mtime_ns)
+                            file_documents[path] = (signature, docs)
+                    logger.info(
+                        f"Parsed {len(stale_paths)} of {len(paths)} files, "
+                        "reusing the rest"
+                    )
+                    results = [
+                        loaded[path] if path in loaded else file_documents[path][1]
+                        for path in paths
+                    ]
+                    self._embedding_cache["file_documents"] = file_documents
 
                     processed_count = sum(1 for r in results if r)
-                    for docs in results:
-                        documents.extend(docs)
+                    # Identical text is embedded once, and the kept document
+                    # lists the other files it also came from. Remember which
+                    # documents each upload maps to for remove_file
+                    unique_docs = {}
+                    file_doc_ids = {}
+                    for path, docs in zip(paths, results):
+                        doc_ids = []
+                        for doc in docs:
+                            kept = unique_docs.setdefault(
+                                _content_key(doc.get_content()), doc
+                            )
+                            if kept is doc:
+                                # Reused documents still list the last build's
+                                # duplicates
+                                doc.metadata.pop("also_in", None)
+                                documents.append(doc)
+                            else:
+                                _add_duplicate_source(kept, doc)
+                            doc_ids.append(kept.doc_id)
+                        if doc_ids:
+                            file_doc_ids[path] = list(dict.fromkeys(doc_ids))
+                    logger.info(
+                        f"Indexing {len(documents)} unique of "
+                        f"{sum(len(docs) for docs in results)} documents"
+                    )
 
                     if not documents:
                         logger.warning("No documents could be processed")
@@ -335,32 +911,55 @@ class IndexManager:
                     # Create index with improved settings
                     logger.info("Creating vector index...")
                     try:
-                        storage_context = StorageContext.from_defaults()
-                        self.index = VectorStoreIndex.from_documents(
-                            documents,
-                            storage_context=storage_context,
+                        # Split large sets across processes; embedding stays in
+                        # this process so the model is not pickled into every
+                        # worker. Pages of small uploads split faster here than
+                        # a spawned interpreter can import llama_index
+                        workers = min(
+                            _MAX_SPLIT_WORKERS,
+                            os.cpu_count() or 1,
+                            sum(len(doc.text) for doc in documents)
+                            // _SPLIT_CHARS_PER_WORKER,
+                        )
+                        pipeline = IngestionPipeline(
                             transformations=[
                                 SentenceSplitter(
                                     chunk_size=Settings.chunk_size,
                                     chunk_overlap=Settings.chunk_overlap,
+                                    tokenizer=self._splitter_tokenizer(),
                                 )
-                            ],
+                            ]
+                        )
+                        nodes = pipeline.run(
+                            documents=documents,
+                            num_workers=workers if workers > 1 else None,
+                        )
+                        self._embed_nodes(nodes)
+                        storage_context = self._faiss_storage_context(nodes)
+                        vector_store = "faiss" if storage_context else "float16"
+                        storage_context = (
+                            storage_context
+                            or StorageContext.from_defaults(
+                                vector_store=Float16VectorStore()
+                            )
+                        )
+                        index = VectorStoreIndex(
+                            nodes,
+                            storage_context=storage_context,
                             embed_model=self.embed_model,
                             show_progress=True,
                         )
+                        # Set with the index, so queries arriving before the
+                        # persist finishes do not see it as out of date
+                        fingerprint = self._fingerprint(self._stat_cache)
+                        self._index_fingerprint = fingerprint
+                        self.index = index
 
-                        # Persist index
-                        storage_context.persist(persist_dir=self.storage_dir)
                         self.last_index_time = time.time()
-
-                        # Update file hash cache
-                        current_file_hashes = {
-                            entry.name: f"{entry.stat().st_size}_{entry.stat().st_mtime}"
-                            for entry in os.scandir(self.data_dir)
-                            if entry.is_file()
-                        }
-                        self._embedding_cache["file_hashes"] = current_file_hashes
-                        self._save_caches()
+                        self._embedding_cache["file_doc_ids"] = file_doc_ids
+                        self._embedding_cache["vector_store"] = vector_store
+                        self._index_changed()
+                        self._persist_async(storage_context, fingerprint)
 
                         logger.info(
                             f"Index built with {len(documents)} documents from {processed_count} files"
@@ -379,35 +978,82 @@ class IndexManager:
                 self._index_build_thread.join()
             return True
 
-    def _process_json_file(self, file_path: str):
-        """Handle a single JSON document"""
-        try:
-            reader = JSONReader(levels_back=2, collapse_length=500)
-            docs = reader.load_data(file_path)
-            for doc in docs:
-                doc.metadata.update(get_file_metadata(file_path))
-            logger.info(f"Processed JSON file: {file_path}")
-            return docs
-        except Exception as e:
-            logger.error(f"JSON error {file_path}: {e}")
-            return []
+    def remove_file(self, file_path: str) -> bool:
+        """Drop a deleted upload's documents from the index without a full rebuild"""
+        if self._index_build_thread and self._index_build_thread.is_alive():
+            self._index_build_thread.join()
+        self._wait_for_persist()
 
-    def _process_json_files(self):
-        """Handle JSON documents - Deprecated, use _process_json_file instead"""
-        return []
+        file_doc_ids = self._embedding_cache.get("file_doc_ids", {})
+        if not self.index or file_path not in file_doc_ids:
+            # Indexes built before doc ids were tracked need one full rebuild
+            return self.build_index(force=True)
+        if self._embedding_cache.get("vector_store") == "faiss":
+            # IVF-PQ codes cannot be removed by document
+            return self.build_index(force=True)
+
+        with self._index_build_lock:
+            try:
+                # Set first, so queries during the removal and its persist
+                # do not start a rebuild of their own
+                fingerprint = self._fingerprint(self._scan_session_files())
+                self._index_fingerprint = fingerprint
+                # Documents deduplicated across uploads stay while any remain
+                shared = {
+                    doc_id
+                    for path, doc_ids in file_doc_ids.items()
+                    if path != file_path
+                    for doc_id in doc_ids
+                }
+                for doc_id in file_doc_ids[file_path]:
+                    if doc_id not in shared:
+                        self.index.delete_ref_doc(doc_id, delete_from_docstore=True)
+                del file_doc_ids[file_path]
+                self._embedding_cache.get("file_documents", {}).pop(file_path, None)
+                self._index_changed()
+                self._persist_async(self.index.storage_context, fingerprint)
+                logger.info(f"Removed {file_path} from index")
+                return True
+            except Exception as e:
+                logger.error(f"Failed to remove {file_path} from index: {e}")
+                # The persisted fingerprint no longer matches, so the next
+                # query rebuilds
+                self._index_fingerprint = None
+                return False
 
     def load_index(self):
         """Load existing index"""
         try:
-            required_files = ["docstore.json", "vector_store.json"]
-            if all((Path(self.storage_dir) / f).exists() for f in required_files):
+            required_files = ["docstore.json", _VECTOR_STORE_FILE]
+            if (
+                all((Path(self.storage_dir) / f).exists() for f in required_files)
+                and self._index_is_current()
+            ):
+                vector_store = None
+                if self._embedding_cache.get("vector_store") == "faiss":
+                    import faiss
+                    from llama_index.vector_stores.faiss import FaissVectorStore
+
+                    # Map the codes instead of reading them onto the heap, so
+                    # restarts share the page cache; the loaded index is only
+                    # queried, since any change rebuilds it
+                    faiss_index = faiss.read_index(
+                        os.path.join(self.storage_dir, _VECTOR_STORE_FILE),
+                        faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY,
+                    )
+                    vector_store = FaissVectorStore(faiss_index=faiss_index)
+                elif self._embedding_cache.get("vector_store") == "float16":
+                    vector_store = Float16VectorStore.from_persist_path(
+                        os.path.join(self.storage_dir, _VECTOR_STORE_FILE)
+                    )
                 storage_context = StorageContext.from_defaults(
-                    persist_dir=self.storage_dir
+                    vector_store=vector_store, persist_dir=self.storage_dir
                 )
                 self.index = load_index_from_storage(storage_context)
+                self._index_changed()
                 logger.info("Loaded existing index")
             else:
-                logger.warning("Missing index files - rebuilding...")
+                logger.warning("Index files missing or out of date - rebuilding...")
                 self.build_index()
         except Exception as e:
             logger.error(f"Index load error: {e}")
@@ -423,32 +1069,64 @@ class IndexManager:
             threading.Thread(target=self.build_index, daemon=True).start()
 
         try:
-            # Run embedding and search in thread pool
-            def _async_query():
-                query_engine = self.index.as_query_engine(
-                    similarity_top_k=top_k,
-                    vector_store_kwargs={
-                        "similarity_cutoff": 0.7,
-                        "distance_metric": "cosine",
-                    },
-                    response_mode="compact",
-                )
-                return query_engine.query(query)
-
-            future = self._processing_pool.submit(_async_query)
-            response = future.result(timeout=30)  # 30 second timeout
-            nodes = getattr(response, "source_nodes", [])
-
-            if nodes and hasattr(nodes[0], "score"):
-                nodes = sorted(
-                    nodes, key=lambda x: getattr(x, "score", 0), reverse=True
-                )
-
-            return nodes
-
+            # The normalized query is only the cache key; the query as typed
+            # is what gets embedded
+            key = (_WHITESPACE_RE.sub(" ", query.strip().lower()), top_k)
+            with self._query_cache_lock:
+                nodes = self._query_cache.get(key)
+                if nodes is not None:
+                    self._query_cache.move_to_end(key)
+            if nodes is None:
+                nodes = self._retrieve(query, top_k)
+                with self._query_cache_lock:
+                    self._query_cache[key] = nodes
+                    if len(self._query_cache) > _QUERY_CACHE_SIZE:
+                        self._query_cache.popitem(last=False)
+            return list(nodes)
         except concurrent.futures.TimeoutError:
             logger.error("Query timed out")
             return []
         except Exception as e:
             logger.error(f"Query failed: {e}")
             return []
+
+    def _index_changed(self):
+        """Drop everything derived from the previous index"""
+        with self._query_cache_lock:
+            self._query_cache.clear()
+        self._retrievers.clear()
+
+    def _retriever(self, top_k: int):
+        """Retriever for top_k, built once per index"""
+        retriever = self._retrievers.get(top_k)
+        if retriever is None:
+            retriever = self._retrievers[top_k] = self.index.as_retriever(
+                similarity_top_k=top_k
+            )
+        return retriever
+
+    def _retrieve(self, query: str, top_k: int):
+        """Run a query against the index; query_index caches the results"""
+
+        # Run embedding and search in thread pool
+        def _async_query():
+            if self._embedding_cache.get("vector_store") == "faiss":
+                self.index.vector_store.client.nprobe = max(8, top_k * 2)
+            # Embedded here rather than by the retriever, to hold the lock
+            with _embed_model_lock:
+                embedding = self.embed_model.get_query_embedding(query)
+            return self._retriever(top_k).retrieve(
+                QueryBundle(query_str=query, embedding=embedding)
+            )
+
+        future = self._processing_pool.submit(_async_query)
+        nodes = future.result(timeout=30)  # 30 second timeout
+        # Vector stores ignore a cutoff passed to the retriever, so apply it
+        # here; hashed fallback vectors have no meaningful similarity scale
+        if not isinstance(self.embed_model, BasicEmbedding):
+            nodes = self._similarity_filter.postprocess_nodes(nodes)
+
+        if nodes and hasattr(nodes[0], "score"):
+            nodes = sorted(nodes, key=lambda x: getattr(x, "score", 0), reverse=True)
+
+        return nodes
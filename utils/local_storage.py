@@ -46,6 +46,54 @@ class LocalStorageManager:
                         return false;
                     }
                 },
+                append: function(key, items) {
+                    try {
+                        let store = JSON.parse(localStorage.getItem('docuverse_data'));
+                        let target = store;
+                        if (key.includes('_')) {
+                            // Handle session-specific data
+                            const [type, sessionId] = key.split('_');
+                            if (!store.sessions[sessionId]) {
+                                store.sessions[sessionId] = {};
+                            }
+                            target = store.sessions[sessionId];
+                            key = type;
+                        }
+                        target[key] = (target[key] || []).concat(items);
+                        localStorage.setItem('docuverse_data', JSON.stringify(store));
+                        return true;
+                    } catch (e) {
+                        console.error('Error appending to localStorage:', e);
+                        return false;
+                    }
+                },
+                put: function(key, field, item) {
+                    try {
+                        let store = JSON.parse(localStorage.getItem('docuverse_data'));
+                        let target = store;
+                        if (key.includes('_')) {
+                            // Handle session-specific data
+                            const [type, sessionId] = key.split('_');
+                            if (!store.sessions[sessionId]) {
+                                store.sessions[sessionId] = {};
+                            }
+                            target = store.sessions[sessionId];
+                            key = type;
+                        }
+                        let entries = target[key] || {};
+                        if (Array.isArray(entries)) {
+                            // Lists saved by older versions are keyed on first write
+                            entries = Object.fromEntries(entries.map(e => [e[field], e]));
+                        }
+                        entries[item[field]] = Object.assign(entries[item[field]] || {}, item);
+                        target[key] = entries;
+                        localStorage.setItem('docuverse_data', JSON.stringify(store));
+                        return true;
+                    } catch (e) {
+                        console.error('Error updating localStorage:', e);
+                        return false;
+                    }
+                },
                 load: function(key) {
                     try {
                         let store = JSON.parse(localStorage.getItem('docuverse_data'));
@@ -96,6 +144,32 @@ class LocalStorageManager:
             st.error(f"Error saving to local storage: {e}")
             return False
 
+    def append_data(self, key: str, items: list) -> bool:
+        """Append items to a list in local storage without resending the list."""
+        js_code = f"""
+            const items = {json.dumps(items)};
+            window.handleLocalStorage.append('{key}', items);
+        """
+        try:
+            components.html(f"<script>{js_code}</script>", height=0)
+            return True
+        except Exception as e:
+            st.error(f"Error appending to local storage: {e}")
+            return False
+
+    def put_item(self, key: str, field: str, item: Dict[str, Any]) -> bool:
+        """Upsert an item into a local storage object keyed by item[field]."""
+        js_code = f"""
+            const item = {json.dumps(item)};
+            window.handleLocalStorage.put('{key}', '{field}', item);
+        """
+        try:
+            components.html(f"<script>{js_code}</script>", height=0)
+            return True
+        except Exception as e:
+            st.error(f"Error updating local storage: {e}")
+            return False
+
     def load_data(self, key: str) -> Optional[Any]:
         """Load data from local storage."""
         js_code = f"""